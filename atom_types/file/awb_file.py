@@ -69,7 +69,12 @@ class AwbFilesArray(Construct):
             e = e() if callable(e) else e
             pad_stream()
             context._index = i
-            buildret = Bytes(len(e))._build(e, stream, context, path)
+            if isinstance(e, memoryview):
+                # memory-mapped entry, written without copying
+                stream.write(e)
+                buildret = e
+            else:
+                buildret = Bytes(len(e))._build(e, stream, context, path)
             retList.append(buildret)
             pointerList.append(stream_tell(stream, path))
         
@@ -1,11 +1,18 @@
 import io
 import logging
-from typing import List, Type
+import mmap
+import struct
+from array import array
+from typing import Dict, List, NamedTuple, Type
 from construct import Array, Int16ub
+from atom_types.runtime import util
+from atom_types.runtime.awb_index import AwbIndex
+from atom_types.runtime.references import LAYERS, ReferenceGraph, read_blob, remap_reference_items, \
+    remap_track_events
 from atom_types.runtime.table.cue import CueTable
 from atom_types.runtime.table.cue_name import CueNameTable
 from atom_types.runtime.table.sequence import SequenceTable
-from atom_types.runtime.table.stream_awb import StreamAwbTable
+from atom_types.runtime.table.stream_awb import AwbCommit, StreamAwbTable
 from atom_types.runtime.table.stream_awb_header import StreamAwbAfs2Header
 from atom_types.runtime.table.synth import SynthTable
 from atom_types.runtime.table.table_base import TableBase
@@ -54,6 +61,16 @@ from atom_types.runtime.utf import Utf, UtfBlob
 # StreamAwbTocWork                              Y/N/N (A mystery. A large block of 0s with a non-fixed random-seeming size)
 # StreamAwbAfs2Header       StreamAwbHeader     Y/Y/N
 
+class NewSong(NamedTuple):
+    cue_name: str
+    awb_id: int
+    awb_file_id: int
+    num_samples: int
+    length_ms: int
+    # CommandIndex usually 1, but depends on version. 0 on 3.10; 1 on 3.07.
+    command_index: int = 1
+
+
 class AwbTables:
     awb_tables = {
         "cueNames": CueNameTable,
@@ -66,96 +83,300 @@ class AwbTables:
         "streamAwbHeaders": StreamAwbAfs2Header
     }
     
+    def parseBlob(self, blob: UtfBlob) -> Utf:
+        if blob.mapped:
+            # parse in place, so the sub-table's blobs are views into the mapping as well
+            return Utf.parse_stream(blob.stream, blob.pos, lazy=self.lazy)
+        return Utf.parse(blob.read(), lazy=self.lazy)
+
     def parseTable(self, utf: Utf, attrName: str, columnName: str, type: Type[TableBase]):
         self.log.debug(f"Parse {type.__name__}")
-        setattr(self, attrName, type.parse(utf.get(0, columnName).read()))
-        
-    def __init__(self, awbDirectory: str, utf: Utf):
+        setattr(self, attrName, type(self.parseBlob(utf.get(0, columnName))))
+
+    def parseStreamAwbs(self, utf: Utf):
+        self.log.debug(f"Parse {StreamAwbTable.__name__}")
+        self.streamAwbs = StreamAwbTable(self.parseBlob(utf.get(0, "StreamAwbHash")), self.awbDirectory,
+                                         self.useMmap)
+
+    def __init__(self, awbDirectory: str, utf: Utf, lazy: bool = False, useMmap: bool = False):
         self.log = logging.getLogger("awb_tables")
+        self.awbDirectory = awbDirectory
+        self.utf = utf
+        self.lazy = lazy
+        self.useMmap = useMmap
+
+        # Parse all tables, unless they should be parsed on first access
+        if not lazy:
+            for name, type in self.awb_tables.items():
+                self.parseTable(utf, name, type.__name__, type)
+            self.parseStreamAwbs(utf)
+
+    def __getattr__(self, name):
+        # only reached for tables that haven't been parsed yet
+        if name in self.awb_tables:
+            type = self.awb_tables[name]
+            self.parseTable(self.utf, name, type.__name__, type)
+        elif name == "streamAwbs":
+            self.parseStreamAwbs(self.utf)
+        elif name == "references":
+            # built on first use, then kept up to date by the tables
+            self.references = ReferenceGraph(self)
+        else:
+            raise AttributeError(f"'{self.__class__.__name__}' object has no attribute '{name}'")
+        return self.__dict__[name]
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self.__dict__
 
-        # Parse all tables
-        for name, type in self.awb_tables.items():
-            self.parseTable(utf, name, type.__name__, type)
-        self.streamAwbs = StreamAwbTable.parse(awbDirectory, utf.get(0, "StreamAwbHash").read())
-        
     def buildTable(self, utf: Utf, attrName: str, columnName: str, type: Type[TableBase]):
         self.log.debug(f"Build {type.__name__}")
-        stream = getattr(self, attrName).build()
+        table = getattr(self, attrName)
+        stream = table.build()
         blob = UtfBlob(columnName, stream, 0, len(stream.getbuffer()))
+        self.logSizeDiff(columnName, utf.get(0, columnName), blob, table.utf)
         utf.set(0, columnName, blob)
+
+    def logSizeDiff(self, columnName: str, original: UtfBlob, rebuilt: UtfBlob, table: Utf):
+        originalSize = original.length if original else 0
+        report = table.lastBuildReport
+        saved = f", saved {report.stringBytesSaved} in strings and {report.blobBytesSaved} in blobs" if report else ""
+        self.log.debug(f"{columnName}: {originalSize} -> {rebuilt.length} bytes "
+                       f"({rebuilt.length - originalSize:+}){saved}")
         
+    def is_dirty(self, name: str) -> bool:
+        return self.is_loaded(name) and getattr(self, name).dirty
+
     def buildAll(self, utf: Utf):
+        # tables that were never parsed or changed keep their original blob
+        rebuilt = 0
         for name, type in self.awb_tables.items():
-            self.buildTable(utf, name, type.__name__, type)
-        stream = self.streamAwbs.build()
-        blob = UtfBlob("StreamAwbHash", stream, 0, len(stream.getbuffer()))
-        utf.set(0, "StreamAwbHash", blob)
+            if self.is_dirty(name):
+                self.buildTable(utf, name, type.__name__, type)
+                getattr(self, name).dirty = False
+                rebuilt += 1
+        if self.is_dirty("streamAwbs"):
+            stream = self.streamAwbs.build()
+            blob = UtfBlob("StreamAwbHash", stream, 0, len(stream.getbuffer()))
+            self.logSizeDiff("StreamAwbHash", utf.get(0, "StreamAwbHash"), blob, self.streamAwbs.utf)
+            utf.set(0, "StreamAwbHash", blob)
+            self.streamAwbs.dirty = False
+            rebuilt += 1
+        self.log.debug(f"Rebuilt {rebuilt} tables, reused {len(self.awb_tables) + 1 - rebuilt} original tables")
     
 class Acb(TableBase):
     tables: AwbTables
 
-    def __init__(self, awbDirectory: str, utf: Utf):
+    def __init__(self, awbDirectory: str, utf: Utf, lazy: bool = False, useMmap: bool = False):
         self.log = logging.getLogger("acb")
         self.utf = utf
         self.awbDirectory = awbDirectory
-        self.tables = AwbTables(awbDirectory, utf)
+        self.tables = AwbTables(awbDirectory, utf, lazy, useMmap)
+        # the mapped ACB file, for ACBs parsed with use_mmap
+        self.mapping = None
         
     def build_stream(self, stream):
-        self.sort_cue_name_table() # sort the cue name table now that we're about to build
+        # no need to sort the cue name table, CueNameTable keeps it sorted
         self.tables.buildAll(self.utf)
         super().build_stream(stream)
         
     @classmethod
-    def parse_stream(cls, awbDirectory, stream, pos=None):
-        return cls(awbDirectory, Utf.parse_stream(stream, pos))
+    def parse_stream(cls, awbDirectory, stream, pos=None, lazy=None, use_mmap=False):
+        """:param: lazy: Parse sub-tables and their rows on first access (defaults to Utf.lazy)
+        :param: use_mmap: Map the ACB file (and the streaming AWBs) into memory, so sub-tables are parsed in place
+            and blobs are written back without copying. The stream has to be a real file. Mapped files must not be
+            written in place: build to another file, and close() the Acb before replacing the original with it"""
+        lazy = Utf.lazy if lazy is None else lazy
+        if not use_mmap:
+            return cls(awbDirectory, Utf.parse_stream(stream, pos, lazy=lazy), lazy, use_mmap)
+        mapping = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        acb = cls(awbDirectory, Utf.parse_stream(mapping, pos, lazy=lazy), lazy, use_mmap)
+        acb.mapping = mapping
+        return acb
+
+    def close(self):
+        """Closes the mapped ACB file and the streaming AWBs. Nothing that was parsed can be used afterwards."""
+        if self.tables.is_loaded("streamAwbs"):
+            self.tables.streamAwbs.close()
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
 
     def add_song_to_awb(self, cue_name: str, awb_id: int, awb_file_id: int, num_samples: int, length_ms: int, command_index: int = 1):
-        waveform_id_1 = self.tables.waveforms.add(awb_id, awb_file_id, num_samples) # HP
-        waveform_id_2 = self.tables.waveforms.add(awb_id, awb_file_id, num_samples) # SP
-        synth_id_1 = self.tables.synths.add(waveform_id_1)
-        synth_id_2 = self.tables.synths.add(waveform_id_2)
-        track_event_id_1 = self.tables.trackEvents.add(synth_id_1)
-        track_event_id_2 = self.tables.trackEvents.add(synth_id_2)
-        track_id_1 = self.tables.tracks.add(track_event_id_1, "headphone")
-        self.log.debug(f"Add Track 1 -> event ID {track_event_id_1}, headphone")
-        track_id_2 = self.tables.tracks.add(track_event_id_2, "speaker")
-        self.log.debug(f"Add Track 2 -> event ID {track_event_id_2}, speaker")
-
-        # CommandIndex usually 1, but depends on version. 0 on 3.10; 1 on 3.07.
-        # 0 in 3.07 seems to be "play nothing" or something
-        sequence_id = self.tables.sequences.add(2, [track_id_1, track_id_2], command_index)
-        self.log.debug(f"Add Sequence -> ID {sequence_id}, track IDs [{track_id_1}, {track_id_2}]")
+        self.add_songs([NewSong(cue_name, awb_id, awb_file_id, num_samples, length_ms, command_index)])
+
+    def add_songs(self, songs: List[NewSong]) -> List[int]:
+        """Adds the rows for many songs, one table at a time.
+
+        Every song gets two waveforms (headphone, speaker), each with its own synth, track event and track, plus
+        one sequence playing both tracks, a cue and a cue name. New rows are appended (cue names are inserted in
+        sorted order), so all the IDs follow from the row counts before the batch.
 
-        cue_id = self.tables.cues.add(sequence_id, length_ms) # length = duration in ms
-        self.log.debug(f"Add Cue -> ID {cue_id}, sequence ID = {sequence_id}, length in MS = {length_ms}")
+        :param: songs: NewSong or (cue_name, awb_id, awb_file_id, num_samples, length_ms) tuples
+        :returns: Row indices of the new cue names
+        """
+        songs = [NewSong(*song) for song in songs]
+        # checked before any table is touched, so a bad batch leaves no rows behind
+        seen = set()
+        for song in songs:
+            if song.cue_name in seen or song.cue_name in self.tables.cueNames:
+                raise KeyError(f"Cue name '{song.cue_name}' already present in Cue Name list.")
+            seen.add(song.cue_name)
 
-        cue_name_id = self.tables.cueNames.add(cue_id, cue_name)
-        self.log.debug(f"Add Cue Name '{cue_name}' -> ID {cue_name_id}, cue ID = {cue_id}")
+        waveform_ids = self.tables.waveforms.add_many(
+            [(song.awb_id, song.awb_file_id, song.num_samples) for song in songs for _ in range(2)])
+        synth_ids = self.tables.synths.add_many(waveform_ids)
+        track_event_ids = self.tables.trackEvents.add_many(synth_ids)
+        track_ids = self.tables.tracks.add_many(
+            [(track_event_id, "headphone" if i % 2 == 0 else "speaker") for i, track_event_id in enumerate(track_event_ids)])
+        # 0 in 3.07 seems to be "play nothing" or something
+        sequence_ids = self.tables.sequences.add_many(
+            [(2, [track_ids[i * 2], track_ids[i * 2 + 1]], song.command_index) for i, song in enumerate(songs)])
+        # length = duration in ms
+        cue_ids = self.tables.cues.add_many(
+            [(sequence_id, song.length_ms) for sequence_id, song in zip(sequence_ids, songs)])
+        cue_name_ids = self.tables.cueNames.add_many(
+            [(cue_id, song.cue_name) for cue_id, song in zip(cue_ids, songs)])
+
+        self.log.debug(f"Added {len(songs)} songs -> waveforms {waveform_ids}, tracks {track_ids}, "
+                       f"sequences {sequence_ids}, cues {cue_ids}, cue names {cue_name_ids}")
+        return cue_name_ids
 
     def update_streaming_awb_headers(self, remap: dict[str, str] = None):
-        for awb_id, awb in enumerate(self.tables.streamAwbs.awbList):
-            self.log.debug(f"Updating header for {awb.name}.awb (AWB ID = {awb_id})")
-            # ugly ugly ugly
-            # TODO: refactor?
-            header = io.BytesIO()
-            awb_file_count = len(awb.awb.tree.files)
-            pull_bytes = 16 + (awb_file_count * 2) + ((awb_file_count + 1) * 4)
-            if remap is not None and awb.name + ".awb" in remap:
-                awb_path = self.awbDirectory + "/" + remap[awb.name + ".awb"]
+        """Updates StreamAwbAfs2Header for every streaming AWB that changed.
+
+        Headers of AWBs changed in memory are encoded from the parsed AWB, so no files are read. Untouched AWBs keep
+        their header.
+
+        :param: remap: AWB file name -> file name of a replacement written outside this Acb, like
+            {"MER_BGM_V3_01.awb": "MER_BGM_V3_01.injected"}. Only these headers are read from disk
+        """
+        stream_awbs = self.tables.streamAwbs
+        for awb_id, awb in enumerate(stream_awbs.awbList):
+            if awb.modified:
+                header = awb.awb.build_header()
+            elif remap is not None and awb.name + ".awb" in remap:
+                header = AwbIndex.read_file(self.awbDirectory + "/" + remap[awb.name + ".awb"]).build()
             else:
-                awb_path = self.awbDirectory + "/" + awb.name + ".awb"
+                continue
+            self.log.debug(f"Updating header for {awb.name}.awb (AWB ID = {awb_id})")
+            self.set_streaming_awb_header(awb_id, header)
+
+    def set_streaming_awb_header(self, awb_id: int, header: bytes):
+        # update Header = real header size + 2 bytes of padding or something
+        header += Int16ub.build(0)
+        self.tables.streamAwbHeaders.update(awb_id, UtfBlob("StreamAwbAfs2Header_NoPrepad",
+                                                            io.BytesIO(header), 0, len(header)))
+
+    def commit_streaming_awb(self, awb_id: int, awb_path: str) -> AwbCommit:
+        """Writes a streaming AWB in a single pass, then updates its hash and header in the ACB with what was
+        captured while writing, so the written AWB is never read back.
 
-            with io.open(awb_path, "rb") as awb_file:
-                header.write(awb_file.read(pull_bytes))
-            header.write(Int16ub.build(0)) # some padding or something
-            header.seek(0) # back to beginning so we can read
-            # update Header = real header size + 2 bytes
-            self.tables.streamAwbHeaders.update(awb_id, UtfBlob("StreamAwbAfs2Header_NoPrepad", header, 0, pull_bytes + 2))
+        :param: awb_path: Path of the AWB that will replace the original. Only replaced once it's complete
+        """
+        commit = self.tables.streamAwbs.write_awb(awb_id, awb_path)
+        self.log.debug(f"Committed AWB ID {awb_id} to '{commit.path}', md5 {commit.md5.hex()}")
+        self.set_streaming_awb_header(awb_id, commit.header)
+        return commit
 
     def sort_cue_name_table(self):
         """Destructively sorts CueNameTable rows by CueName.
-        Called after all work is done (by build_stream)."""
-        self.tables.cueNames.utf.rows.sort(key=lambda x: x['CueName'].value)
+        CueNameTable keeps its rows sorted, so this is only needed after editing its rows directly."""
+        if not self.tables.is_dirty("cueNames"):
+            return  # untouched, so it's still in its original order
+        self.tables.cueNames.sort()
+
+    def compact(self) -> Dict[str, int]:
+        """Removes Cue, Sequence, Track, TrackEvent, Synth and Waveform rows that can't be reached from a cue name,
+        and renumbers the references to the remaining rows (CueIndex, ReferenceIndex, TrackIndex, EventIndex, Command
+        and ReferenceItems).
+
+        Nothing is changed if a reachable row has a reference this editor doesn't understand or that points
+        nowhere. References from other tables into these ones are left as they are.
+
+        :returns: Number of removed rows per table
+        :raises ValueError: If a reference can't be followed
+        """
+        graph = self.tables.references
+        cue_name_targets = [util.i16swap(value) for value in self.tables.cueNames.utf.column("CueIndex")]
+
+        def mark(marked: bytearray, index: int, layer: str):
+            if not 0 <= index < len(marked):
+                raise ValueError(f"Row {index} of {layer} is referenced, but doesn't exist.")
+            marked[index] = 1
+
+        # mark every row that's reachable from a cue name
+        reachable = {"cues": bytearray(len(graph.forward["cues"]))}
+        for cue_index in cue_name_targets:
+            mark(reachable["cues"], cue_index, "cues")
+        for layer in LAYERS[:-1]:
+            child = ReferenceGraph.child_of(layer)
+            forward = graph.forward[layer]
+            reachable[child] = bytearray(len(graph.forward[child]))
+            for row in range(len(forward)):
+                if reachable[layer][row]:
+                    if layer == "cues" and not forward[row]:
+                        raise ValueError(f"Cue {row} doesn't reference a sequence, which isn't supported.")
+                    for target in forward[row]:
+                        mark(reachable[child], target, child)
+
+        kept = {layer: [row for row, is_reachable in enumerate(reachable[layer]) if is_reachable] for layer in LAYERS}
+        removed = {layer: len(reachable[layer]) - len(kept[layer]) for layer in LAYERS}
+        if not any(removed.values()):
+            self.log.debug("Nothing to compact")
+            return removed
+
+        # new index of every kept row, -1 for removed rows
+        remap = {}
+        for layer in LAYERS:
+            remap[layer] = array("i", [-1]) * len(reachable[layer])
+            for new_row, row in enumerate(kept[layer]):
+                remap[layer][row] = new_row
+
+        def blob(column_name: str, data: bytes):
+            return UtfBlob(column_name, io.BytesIO(data), 0, len(data))
+
+        # work out every new value before changing anything, since remapping blobs can fail
+        tracks = self.tables.tracks.utf
+        trackEvents = self.tables.trackEvents.utf
+        synths = self.tables.synths.utf
+        updates = [
+            ("cueNames", "CueIndex", [util.i16swap(remap["cues"][index]) for index in cue_name_targets]),
+            ("cues", "ReferenceIndex",
+             [util.i16swap(remap["sequences"][graph.targets("cues", row)[0]]) for row in kept["cues"]]),
+            ("sequences", "TrackIndex", [
+                blob("TrackIndex", struct.pack(f">{len(targets)}h", *(remap["tracks"][t] for t in targets)))
+                for targets in (graph.targets("sequences", row) for row in kept["sequences"])]),
+            ("trackEvents", "Command", [
+                blob("Command", remap_track_events(read_blob(trackEvents.get(row, "Command")), remap["synths"]))
+                for row in kept["trackEvents"]]),
+            ("synths", "ReferenceItems", [
+                blob("ReferenceItems",
+                     remap_reference_items(read_blob(synths.get(row, "ReferenceItems")), remap["waveforms"]))
+                for row in kept["synths"]]),
+        ]
+        if "EventIndex" in tracks.columns:
+            updates.append(("tracks", "EventIndex", [
+                util.i16swap(remap["trackEvents"][targets[0]]) if targets else tracks.get(row, "EventIndex")
+                for row, targets in ((row, graph.targets("tracks", row)) for row in kept["tracks"])]))
+        for attrName, column_name, values in updates:
+            column = getattr(self.tables, attrName).utf.columns[column_name]
+            if column.types.column == "constant" and any(value != column.constant for value in values):
+                raise ValueError(f"Can't renumber constant column {column_name} of {attrName}.")
+
+        for layer in LAYERS:
+            if removed[layer]:
+                getattr(self.tables, layer).utf.select_rows(kept[layer])
+        for attrName, column_name, values in updates:
+            utf = getattr(self.tables, attrName).utf
+            if utf.columns[column_name].types.column == "constant":
+                continue
+            for row, value in enumerate(values):
+                utf.rows[row][column_name].value = value
+        for attrName in ("cueNames",) + LAYERS:
+            getattr(self.tables, attrName).mark_dirty()
+
+        self.log.debug(f"Compacted tables, removed rows: {removed}")
+        return removed
 
     # def update_song(self, awbWaveformIndex: int, awbName: Optional[str] = None,
     #                 awbIndex: Optional[int] = None, cueName: Optional[str] = None,
@@ -1,48 +1,146 @@
+import mmap
+import os
 from io import BytesIO
 
-from construct import Container, GreedyBytes, Lazy
-from construct.core import evaluate, Bytes
-from atom_types.file.awb_file import Awb_File, Awb_File_Header
+from construct import Container, ListContainer
+from atom_types.runtime.awb_index import AwbEntryList, AwbIndex
+from atom_types.runtime.util import atomic_write
+from atom_types.runtime.awb_writer import AwbEntryRef, AwbWriter, entry_length, layout_pointers, pack_header
 
 class Awb:
-    def __init__(self, tree: Container):
+    def __init__(self, tree: Container, pool=None):
+        """:param: pool: FilePool that entries in files are read through"""
         self.tree = tree
-        # self.headerUpToDate = True
+        self.pool = pool
+        # set by the methods that change the entries
+        self.modified = False
+        # objects with an awb_changed(awb) method, told whenever the entries change
+        self.listeners = []
+        # the mapped file, for AWBs parsed with use_mmap
+        self.mapping = None
     
     @classmethod
-    def parse_stream(cls, stream):
-        tree = Awb_File.parse_stream(stream)
-        return cls(tree)
+    def parse_stream(cls, stream, source=None):
+        """Only reads the header (into an AwbIndex). Entries are read from source when needed.
+
+        :param: source: Path or stream the entries are read from, defaults to stream"""
+        index = AwbIndex.read(stream)
+        return cls(Container(header=index, files=AwbEntryList(index, stream if source is None else source)))
     
     @classmethod
-    def parse_file(cls, filename):
-        f = open(filename, 'rb')
-        return cls.parse_stream(f)
+    def parse_file(cls, filename, use_mmap=False, pool=None):
+        """:param: use_mmap: Map the file into memory and keep entries as memoryview slices of the mapping. The
+            mapping is closed by close() and by build_file. The file must not be written in place while it's mapped
+        :param: pool: FilePool to read the file through. Otherwise it is only open while the header is read"""
+        if pool is not None and not use_mmap:
+            with pool.borrow(filename) as f:
+                f.seek(0)
+                awb = cls.parse_stream(f, filename)
+            awb.pool = pool
+            return awb
+        if not use_mmap:
+            # entries refer to the file by path, so nothing is kept open
+            with open(filename, 'rb') as f:
+                return cls.parse_stream(f, filename)
+
+        with open(filename, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        awb = cls.parse_stream(mapping)
+        awb.mapping = mapping
+        index = awb.tree.header
+        view = memoryview(mapping)
+        awb.tree.files = ListContainer(view[offset:offset + length]
+                                       for offset, length in zip(index.offsets(), index.lengths()))
+        return awb
     
-    def build_stream(self, stream) -> None:
-        Awb_File.build_stream(self.tree, stream)
+    def build_stream(self, stream, hasher=None) -> bytes:
+        """Entries that are still in a file are copied from it, so the archive is never read into memory.
+
+        :param: hasher: hashlib object to feed everything written to, like hashlib.md5()
+        :returns: The header that was written"""
+        writer = AwbWriter(stream, hasher)
+        writer.write(self.tree.header, self.tree.files)
+        return writer.header
+    
+    def build_header(self) -> bytes:
+        """The header build_stream would write for the current entries, without writing anything."""
+        header = self.tree.header
+        files = self.tree.files
+        lengths = [entry_length(file() if callable(file) else file) for file in files]
+        pointers = layout_pointers(lengths, len(files), header.pointerSize, header.alignmentSize)
+        return pack_header(header.version, header.pointerSize, header.unk1, header.alignmentSize, pointers)
     
     def build_header_stream(self, stream) -> None:
-        Awb_File_Header.build_stream(self.tree.header, stream)
+        stream.write(self.build_header())
         
-    def build_file(self, filename) -> None:
-        with open(filename, 'wb') as f:
-            self.build_stream(f)
+    def build_file(self, filename, hasher=None) -> bytes:
+        """Written to a temporary file that replaces filename once it's complete.
+
+        Entries are read from filename afterwards, since it holds all of them now. That way filename can be the file
+        the entries were read from, and the other files they came from can be deleted. If the file can't be
+        replaced, the Awb has to be parsed again."""
+        with atomic_write(filename) as f:
+            header = self.build_stream(f, hasher)
+            # before the replace, since Windows can't replace a file that is still open
+            self.__reopen(filename, header)
+        return header
+
+    def __reopen(self, filename, header: bytes):
+        """Points every entry at filename, which will hold an archive with this header, and lets go of the files
+        they were read from."""
+        index = AwbIndex.read(BytesIO(header))
+        if self.pool is not None:
+            # a handle opened before the replace would still read the old file
+            self.pool.discard(filename)
+        self.tree = Container(header=index, files=AwbEntryList(index, os.fspath(filename)))
+        # the old entries are gone, so nothing refers to the mapping anymore
+        self.close()
+
+    def close(self):
+        """Closes the mapped file, for AWBs parsed with use_mmap. Entries that are views into it must not be used
+        afterwards."""
+        if self.mapping is None:
+            return
+        if isinstance(self.tree.files, ListContainer):
+            self.tree.files = ListContainer()
+        try:
+            self.mapping.close()
+        except BufferError:
+            # entries handed out by getFile are still in use. It's unmapped once the last of them is gone
+            pass
+        self.mapping = None
     
     def getFile(self, index: int) -> bytes:
-        return evaluate(self.tree.files[index])
+        file = self.tree.files[index]
+        if isinstance(file, AwbEntryRef):
+            return file.read(self.pool)
+        # lazily parsed entries are evaluated on access, memory-mapped entries are memoryviews
+        return file() if callable(file) else file
     
+    @staticmethod
+    def toEntry(file):
+        """Paths are kept as a reference to the whole file, which is only read when the AWB is built, so it has to
+        exist until then (build_file stops referring to it). File objects are read now."""
+        if isinstance(file, (str, os.PathLike)):
+            return AwbEntryRef(os.fspath(file), 0, os.stat(file).st_size)
+        return file.read()
+    
+    def __changed(self):
+        self.modified = True
+        for listener in self.listeners:
+            listener.awb_changed(self)
+
     def overwriteFile(self, index: int, file) -> None:
-        buf = file.read()
-        self.tree.files[index] = Bytes(len(buf)).parse(buf)
-        # self.headerUpToDate = False
+        """:param: file: Path or file object"""
+        self.tree.files[index] = self.toEntry(file)
+        self.__changed()
     
     def appendFile(self, file) -> int:
-        buf = file.read()
-        self.tree.files.append(Bytes(len(buf)).parse(buf))
-        # self.headerUpToDate = False
+        """:param: file: Path or file object"""
+        self.tree.files.append(self.toEntry(file))
+        self.__changed()
         return len(self.tree.files) - 1
     
     def popFile(self, index: int) -> None:
         self.tree.files.pop(index)
-        # self.headerUpToDate = False
\ No newline at end of file
+        self.__changed()
@@ -0,0 +1,153 @@
+import sys
+from array import array
+from collections.abc import MutableSequence
+
+from atom_types.runtime.awb_writer import AWB_HEADER, AwbEntryRef, align, header_size, pack_header
+
+# array typecodes for each pointer size
+POINTER_TYPECODES = {2: "H", 4: "I", 8: "Q"}
+
+
+def le_array(typecode: str, data: bytes) -> array:
+    values = array(typecode, data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+class AwbIndex:
+    """The header of an AFS2 archive: everything needed to find its entries, without the entries.
+
+    Read with two struct/array reads, so it costs the same for any number of entries. Cue IDs and pointers are
+    kept as arrays instead of one object per entry.
+    """
+
+    def __init__(self, version: int, pointerSize: int, unk1: int, alignmentSize: int, cueIds: array,
+                 pointers: array):
+        self.version = version
+        self.pointerSize = pointerSize
+        self.unk1 = unk1
+        self.alignmentSize = alignmentSize
+        self.cueIds = cueIds
+        self.pointers = pointers
+
+    @classmethod
+    def read(cls, stream) -> "AwbIndex":
+        """Reads the header at the current position of stream."""
+        data = stream.read(AWB_HEADER.size)
+        if len(data) < AWB_HEADER.size:
+            raise EOFError("AWB header is truncated")
+        magic, version, pointerSize, unk1, count, alignmentSize = AWB_HEADER.unpack(data)
+        if magic != b"AFS2":
+            raise ValueError(f"Not an AFS2 archive (magic is {magic})")
+
+        size = header_size(count, pointerSize) - AWB_HEADER.size
+        data = stream.read(size)
+        if len(data) < size:
+            raise EOFError("AWB header is truncated")
+        cueIds = le_array("H", data[:2 * count])
+        data = data[2 * count:]
+        if pointerSize in POINTER_TYPECODES:
+            pointers = le_array(POINTER_TYPECODES[pointerSize], data)
+        else:
+            pointers = array("Q", (int.from_bytes(data[i:i + pointerSize], "little")
+                                   for i in range(0, len(data), pointerSize)))
+        return cls(version, pointerSize, unk1, alignmentSize, cueIds, pointers)
+
+    @classmethod
+    def read_file(cls, filename) -> "AwbIndex":
+        with open(filename, "rb") as f:
+            return cls.read(f)
+
+    def __len__(self):
+        return len(self.pointers) - 1
+
+    @property
+    def headerSize(self) -> int:
+        return header_size(len(self), self.pointerSize)
+
+    @property
+    def size(self) -> int:
+        """Size of the whole archive."""
+        return self.pointers[-1]
+
+    def offset(self, index: int) -> int:
+        # entries start at the next alignment boundary after their pointer
+        return align(self.pointers[index], self.alignmentSize)
+
+    def length(self, index: int) -> int:
+        return self.pointers[index + 1] - self.offset(index)
+
+    def offsets(self) -> array:
+        return array("Q", (align(pointer, self.alignmentSize) for pointer in self.pointers[:-1]))
+
+    def lengths(self) -> array:
+        return array("Q", (end - start for start, end in zip(self.offsets(), self.pointers[1:])))
+
+    def entry(self, index: int, source) -> AwbEntryRef:
+        """:param: source: Path or stream of the archive"""
+        return AwbEntryRef(source, self.offset(index), self.length(index))
+
+    def build(self) -> bytes:
+        return pack_header(self.version, self.pointerSize, self.unk1, self.alignmentSize, self.pointers)
+
+
+class AwbEntryList(MutableSequence):
+    """Entries of a parsed archive.
+
+    Entries that haven't been replaced are stored as their position in the index, and only turned into an
+    AwbEntryRef when accessed. Everything else (bytes, other AwbEntryRefs, ...) is kept in objects and stored as a
+    negative number: -1 is objects[0], -2 is objects[1] and so on. Positions are a range until the list is first
+    changed, and an array after that, so there is never an object per entry.
+    """
+
+    def __init__(self, index: AwbIndex, source):
+        self.index = index
+        self.source = source
+        self.positions = range(len(index))
+        self.objects = []
+
+    def __resolve(self, position: int):
+        if position < 0:
+            return self.objects[-1 - position]
+        return self.index.entry(position, self.source)
+
+    def __store(self, value) -> int:
+        self.objects.append(value)
+        return -len(self.objects)
+
+    def __mutable_positions(self) -> array:
+        if isinstance(self.positions, range):
+            self.positions = array("q", self.positions)
+        return self.positions
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.__resolve(position) for position in self.positions[i]]
+        return self.__resolve(self.positions[i])
+
+    def __setitem__(self, i, value):
+        positions = self.__mutable_positions()
+        if isinstance(i, slice):
+            positions[i] = array("q", [self.__store(entry) for entry in value])
+        else:
+            positions[i] = self.__store(value)
+
+    def __delitem__(self, i):
+        del self.__mutable_positions()[i]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def insert(self, i, value):
+        self.__mutable_positions().insert(i, self.__store(value))
+
+    def sources(self) -> set:
+        """Sources of every AwbEntryRef in the list."""
+        sources = set()
+        for position in self.positions:
+            if position >= 0:
+                sources.add(self.source)
+            elif isinstance(self.objects[-1 - position], AwbEntryRef):
+                sources.add(self.objects[-1 - position].source)
+        return sources
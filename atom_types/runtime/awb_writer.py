@@ -0,0 +1,271 @@
+import errno
+import logging
+import os
+import struct
+from typing import BinaryIO, List, NamedTuple, Union
+
+# reads used to copy entries when the kernel can't copy them for us
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+# errors that mean a kernel-side copy isn't possible between these two files, rather than a failed copy
+UNSUPPORTED_COPY_ERRORS = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF, errno.ENOTSUP)
+
+# filesystems with reflinks (btrfs, XFS) can share blocks instead of copying them, but only blocks that are aligned
+# in both files
+REFLINK_BLOCK_SIZE = 4096
+
+AWB_HEADER = struct.Struct("<4sBBHII")
+POINTER_FORMATS = {2: "H", 4: "I", 8: "Q"}
+
+
+class AwbEntryRef(NamedTuple):
+    """An AWB entry that hasn't been read: length bytes at offset in source.
+
+    source is either a path or a seekable binary stream.
+    """
+    source: Union[str, os.PathLike, BinaryIO]
+    offset: int
+    length: int
+
+    def read(self, pool=None) -> bytes:
+        """:param: pool: FilePool to read paths through, instead of opening them for this one read"""
+        if isinstance(self.source, (str, os.PathLike)):
+            if pool is not None:
+                return pool.read(self.source, self.offset, self.length)
+            with open(self.source, "rb") as f:
+                f.seek(self.offset)
+                return f.read(self.length)
+        self.source.seek(self.offset)
+        return self.source.read(self.length)
+
+
+def align(offset: int, alignmentSize: int) -> int:
+    if offset % alignmentSize:
+        offset += alignmentSize - (offset % alignmentSize)
+    return offset
+
+
+def header_size(count: int, pointerSize: int) -> int:
+    return AWB_HEADER.size + 2 * count + pointerSize * (count + 1)
+
+
+def layout_pointers(lengths, count: int, pointerSize: int, alignmentSize: int) -> List[int]:
+    """Pointers of an archive holding entries of the given lengths. The first pointer is the end of the header and
+    every other pointer is the end of an entry, so entry i starts at align(pointers[i])."""
+    pointers = [header_size(count, pointerSize)]
+    for length in lengths:
+        pointers.append(align(pointers[-1], alignmentSize) + length)
+    return pointers
+
+
+def pack_header(version: int, pointerSize: int, unk1: int, alignmentSize: int, pointers: List[int]) -> bytes:
+    """Encodes an AFS2 header. Cue IDs are always numbered from 0, like Awb_File_Header builds them."""
+    count = len(pointers) - 1
+    data = bytearray(AWB_HEADER.pack(b"AFS2", version, pointerSize, unk1, count, alignmentSize))
+    data += struct.pack(f"<{count}H", *range(count))
+    if pointerSize in POINTER_FORMATS:
+        data += struct.pack(f"<{count + 1}{POINTER_FORMATS[pointerSize]}", *pointers)
+    else:
+        for pointer in pointers:
+            data += pointer.to_bytes(pointerSize, "little")
+    return bytes(data)
+
+
+def entry_length(entry) -> int:
+    if isinstance(entry, AwbEntryRef):
+        return entry.length
+    return len(entry)
+
+
+def fileno(stream):
+    try:
+        return stream.fileno()
+    except (AttributeError, OSError):
+        # OSError covers io.UnsupportedOperation, like BytesIO
+        return None
+
+
+class AwbWriter:
+    """Writes an AFS2 archive to a stream entry by entry.
+
+    Entries that still live in a file (AwbEntryRef) are copied by the kernel with os.copy_file_range, or
+    os.sendfile where that isn't supported, without passing through Python. Otherwise they are copied through a
+    single reusable buffer, so memory use doesn't depend on the size of the archive. Only entries given as bytes
+    are held in memory.
+
+    Runs of entries that are laid out the same way in their source as in the output (like every original entry of an
+    archive that was only appended to) are spliced in with a single copy, padding included. Appending to a large
+    archive then costs one kernel copy of the existing payload, which filesystems with reflinks can share instead
+    of copying, plus the new entries.
+
+    With a hasher (like hashlib.md5()), everything written is also fed to it, so the archive doesn't have to be
+    read back to be hashed. Entries are then always copied through the buffer, so each one is only read once, for
+    both the hash and the write.
+    """
+
+    def __init__(self, stream: BinaryIO, hasher=None, spliceRuns: bool = True):
+        """:param: spliceRuns: Copy runs of entries from the same source with one copy instead of one per entry"""
+        self.stream = stream
+        self.hasher = hasher
+        self.spliceRuns = spliceRuns
+        self.fd = fileno(stream)
+        self.log = logging.getLogger("awb_writer")
+        # turned off for the rest of the write the first time they turn out not to work
+        self.useCopyFileRange = hasattr(os, "copy_file_range")
+        self.useSendfile = hasattr(os, "sendfile")
+        self.buffer = None
+        self.sources = {}
+        self.bytesCopied = 0
+        self.bytesWritten = 0
+        self.copies = 0
+        # the header of the last write
+        self.header = None
+
+    def write(self, header, entries) -> List[int]:
+        """Writes the header and every entry.
+
+        :param: header: Parsed header (Awb_File_Header), for version, pointer size and alignment
+        :param: entries: Bytes-like objects, AwbEntryRefs or callables returning bytes (construct Lazy entries)
+        :returns: Pointers written to the header
+        """
+        # lazy entries don't know their length without being read, so they are read up front
+        entries = [entry() if callable(entry) else entry for entry in entries]
+        pointers = layout_pointers([entry_length(entry) for entry in entries], len(entries), header.pointerSize,
+                                   header.alignmentSize)
+        start = self.stream.tell()
+        try:
+            self.header = pack_header(header.version, header.pointerSize, header.unk1, header.alignmentSize,
+                                      pointers)
+            self.__write(self.header)
+            offsets = [align(pointer, header.alignmentSize) for pointer in pointers[:-1]]
+            i = 0
+            while i < len(entries):
+                entry = entries[i]
+                padding = offsets[i] - pointers[i]
+                if padding:
+                    self.__write(b"\x00" * padding)
+                if not isinstance(entry, AwbEntryRef):
+                    self.__write(entry)
+                    i += 1
+                    continue
+                end = i + 1
+                while self.spliceRuns and end < len(entries) and self.__continues_run(
+                        entries[end - 1], entries[end], offsets[end] - offsets[end - 1]):
+                    end += 1
+                last = entries[end - 1]
+                self.__copy(entry, last.offset + last.length - entry.offset)
+                i = end
+        finally:
+            for source in self.sources.values():
+                source.close()
+            self.sources = {}
+            self.buffer = None
+
+        written = self.stream.tell() - start
+        if written != pointers[-1]:
+            raise IOError(f"Wrote {written} bytes of AWB, expected {pointers[-1]}")
+        self.log.debug(f"Wrote {len(entries)} entries ({written} bytes) with {self.copies} copies: "
+                       f"{self.bytesCopied} bytes copied in kernel, {self.bytesWritten} bytes written")
+        return pointers
+
+    def __write(self, data):
+        self.stream.write(data)
+        if self.hasher is not None:
+            self.hasher.update(data)
+        self.bytesWritten += len(data)
+
+    def __open_source(self, entry: AwbEntryRef):
+        if not isinstance(entry.source, (str, os.PathLike)):
+            return entry.source
+        key = os.fspath(entry.source)
+        try:
+            return self.sources[key]
+        except KeyError:
+            self.sources[key] = open(entry.source, "rb", buffering=0)
+            return self.sources[key]
+
+    @staticmethod
+    def __continues_run(previous: AwbEntryRef, entry, distance: int) -> bool:
+        """Whether entry follows previous in its source just like in the output, so that the bytes between them
+        are padding."""
+        return (isinstance(entry, AwbEntryRef) and entry.source == previous.source
+                and entry.offset - previous.offset == distance)
+
+    def __copy(self, entry: AwbEntryRef, length: int):
+        """Copies length bytes from the source of entry, starting at the entry."""
+        source = self.__open_source(entry)
+        offset = entry.offset
+        remaining = length
+        self.copies += 1
+        sourceFd = fileno(source)
+        # the hasher has to see every byte, and the kernel copies them without passing through Python
+        if self.hasher is None and self.fd is not None and sourceFd is not None and remaining:
+            # the kernel writes to the file directly, so everything buffered has to be written out first and the
+            # stream moved past the copy after
+            self.stream.flush()
+            position = self.stream.tell()
+            copied = self.__kernel_copy(sourceFd, offset, remaining, position)
+            self.stream.seek(position + copied)
+            self.bytesCopied += copied
+            offset += copied
+            remaining -= copied
+
+        if remaining:
+            for chunk in self.__read_chunks(source, offset, remaining):
+                self.__write(chunk)
+
+    def __kernel_copy(self, sourceFd: int, offset: int, length: int, position: int) -> int:
+        """Copies as much as the kernel will. Returns the number of bytes copied."""
+        copied = 0
+        # when the copy moves data by whole blocks, the part up to the first block boundary is copied on its own so
+        # the rest can be shared
+        head = -offset % REFLINK_BLOCK_SIZE if (position - offset) % REFLINK_BLOCK_SIZE == 0 else 0
+        while copied < length and self.useCopyFileRange:
+            count = head - copied if copied < head else length - copied
+            try:
+                n = os.copy_file_range(sourceFd, self.fd, min(count, length - copied), offset + copied,
+                                       position + copied)
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_COPY_ERRORS:
+                    raise
+                self.log.debug(f"copy_file_range isn't supported here ({e}), trying sendfile")
+                self.useCopyFileRange = False
+                break
+            if n == 0:
+                raise EOFError(f"AWB entry source ended {length - copied} bytes early")
+            copied += n
+
+        if copied < length and self.useSendfile:
+            # sendfile writes at the current position of the output
+            os.lseek(self.fd, position + copied, os.SEEK_SET)
+            while copied < length:
+                try:
+                    n = os.sendfile(self.fd, sourceFd, offset + copied, length - copied)
+                except OSError as e:
+                    if e.errno not in UNSUPPORTED_COPY_ERRORS:
+                        raise
+                    self.log.debug(f"sendfile isn't supported here ({e}), copying through memory")
+                    self.useSendfile = False
+                    break
+                if n == 0:
+                    raise EOFError(f"AWB entry source ended {length - copied} bytes early")
+                copied += n
+        return copied
+
+    def __read_chunks(self, source, offset: int, length: int):
+        """Yields the range in chunks of up to COPY_BUFFER_SIZE. Each chunk is only valid until the next one."""
+        if self.buffer is None:
+            self.buffer = memoryview(bytearray(COPY_BUFFER_SIZE))
+        source.seek(offset)
+        while length:
+            if hasattr(source, "readinto"):
+                n = source.readinto(self.buffer[:min(length, COPY_BUFFER_SIZE)])
+                data = self.buffer[:n]
+            else:
+                # like mmap
+                data = source.read(min(length, COPY_BUFFER_SIZE))
+                n = len(data)
+            if not n:
+                raise EOFError(f"AWB entry source ended {length} bytes early")
+            yield data
+            length -= n
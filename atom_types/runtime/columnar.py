@@ -0,0 +1,270 @@
+from array import array
+
+# array typecodes for numeric value types
+ARRAY_TYPECODES = {
+    "int8": "b",
+    "uint8": "B",
+    "int16": "h",
+    "uint16": "H",
+    "int32": "i",
+    "uint32": "I",
+    "int64": "q",
+    "uint64": "Q",
+    "float": "f",
+    "double": "d",
+}
+
+# blob offsets below zero are not stream positions
+BLOB_NONE = -1
+BLOB_OBJECT_BASE = -2
+
+
+class UtfCellView:
+    """Stands in for a UtfRowCell of a ColumnarRows row."""
+    __slots__ = ("rows", "column", "index")
+
+    def __init__(self, rows, column, index: int):
+        self.rows = rows
+        self.column = column
+        self.index = index
+
+    @property
+    def value(self):
+        return self.rows.get_value(self.index, self.column.name)
+
+    @value.setter
+    def value(self, value):
+        self.rows.set_value(self.index, self.column.name, value)
+
+
+class UtfRowView:
+    """Stands in for the OrderedDict of a row. Only valid until rows before it are inserted, removed or reordered."""
+    __slots__ = ("rows", "index")
+
+    def __init__(self, rows, index: int):
+        self.rows = rows
+        self.index = index
+
+    def __getitem__(self, name: str) -> UtfCellView:
+        return UtfCellView(self.rows, self.rows.columns[name], self.index)
+
+    def __setitem__(self, name: str, cell):
+        # rows are plain dicts in the row-based storage, where unknown columns are silently dropped on build
+        if name in self.rows.columns:
+            self.rows.set_value(self.index, name, cell.value)
+
+    def __contains__(self, name: str):
+        return name in self.rows.columns
+
+    def __iter__(self):
+        return iter(self.rows.columns)
+
+    def keys(self):
+        return self.rows.columns.keys()
+
+    def values(self):
+        return [self[name] for name in self.rows.columns]
+
+    def items(self):
+        return [(name, self[name]) for name in self.rows.columns]
+
+
+class ColumnarRows:
+    """Row storage for a Utf table with one typed array per variable column instead of one dict per row.
+
+    Numeric columns are array.array, strings are indices into a list of unique strings and blobs are
+    (position, length) arrays into the source stream. Blobs that don't live in the source stream are kept
+    as objects and referenced with a negative position.
+
+    Behaves like the list of rows it replaces: rows are accessed through UtfRowView and UtfCellView.
+    """
+
+    def __init__(self, columns, stream, blobType):
+        self.columns = {column.name: column for column in columns}
+        self.stream = stream
+        self.blobType = blobType
+        self.length = 0
+        self.data = {}
+        self.strings = []
+        self.stringIndex = {}
+        self.blobObjects = []
+        for column in columns:
+            valueType = column.types.value
+            if valueType in ARRAY_TYPECODES:
+                self.data[column.name] = array(ARRAY_TYPECODES[valueType])
+            elif valueType == "string":
+                self.data[column.name] = array("I")
+            elif valueType == "blob":
+                self.data[column.name] = (array("q"), array("I"))
+            else:
+                self.data[column.name] = []
+
+    def __intern(self, value) -> int:
+        if not isinstance(value, str):
+            # empty strings parsed by construct are the raw field
+            value = value.string if value is not None else None
+        value = value or ""
+        try:
+            return self.stringIndex[value]
+        except KeyError:
+            self.strings.append(value)
+            self.stringIndex[value] = len(self.strings) - 1
+            return len(self.strings) - 1
+
+    def __encode_blob(self, name: str, value):
+        if value is None:
+            return BLOB_NONE, 0
+        elif isinstance(value, self.blobType) and value.stream is self.stream and value.columnName == name:
+            # the column name decides the padding of the blob, so only blobs that would be rebuilt identically
+            # are stored as a position
+            return value.pos, value.length
+        else:
+            self.blobObjects.append(value)
+            return BLOB_OBJECT_BASE - (len(self.blobObjects) - 1), value.length
+
+    def extend_column(self, name: str, values):
+        """Appends raw values to a single column. Used by the parser; all columns have to be extended equally."""
+        column = self.columns[name]
+        valueType = column.types.value
+        if valueType == "string":
+            self.data[name].extend(self.__intern(value) for value in values)
+        elif valueType == "blob":
+            positions, lengths = self.data[name]
+            for pos, length in values:
+                positions.append(pos if length else BLOB_NONE)
+                lengths.append(length)
+        else:
+            self.data[name].extend(values)
+
+    def get_value(self, index: int, name: str):
+        column = self.columns[name]
+        valueType = column.types.value
+        if valueType == "string":
+            return self.strings[self.data[name][index]]
+        elif valueType == "blob":
+            positions, lengths = self.data[name]
+            pos = positions[index]
+            if pos == BLOB_NONE:
+                return None
+            elif pos <= BLOB_OBJECT_BASE:
+                return self.blobObjects[BLOB_OBJECT_BASE - pos]
+            # made once and kept, so every access returns the same object
+            blob = self.blobType(name, self.stream, pos, lengths[index])
+            self.blobObjects.append(blob)
+            positions[index] = BLOB_OBJECT_BASE - (len(self.blobObjects) - 1)
+            return blob
+        return self.data[name][index]
+
+    def set_value(self, index: int, name: str, value):
+        column = self.columns[name]
+        valueType = column.types.value
+        if valueType == "string":
+            self.data[name][index] = self.__intern(value)
+        elif valueType == "blob":
+            positions, lengths = self.data[name]
+            positions[index], lengths[index] = self.__encode_blob(name, value)
+        else:
+            self.data[name][index] = value
+
+    def column_values(self, name: str):
+        """Returns every value of a column. Numeric columns are returned as their backing array."""
+        valueType = self.columns[name].types.value
+        if valueType == "string":
+            return [self.strings[i] for i in self.data[name]]
+        elif valueType == "blob":
+            return [self.get_value(i, name) for i in range(self.length)]
+        return self.data[name]
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [UtfRowView(self, i) for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("row index out of range")
+        return UtfRowView(self, index)
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield UtfRowView(self, i)
+
+    def insert(self, index: int, rowData):
+        if index < 0:
+            index = max(0, index + self.length)
+        index = min(index, self.length)
+        for name, column in self.columns.items():
+            # columns missing from new rows (like ControlWorkArea1/2) get filled in before build
+            value = rowData[name].value if name in rowData else None
+            valueType = column.types.value
+            if valueType == "string":
+                self.data[name].insert(index, self.__intern(value))
+            elif valueType == "blob":
+                positions, lengths = self.data[name]
+                pos, length = self.__encode_blob(name, value)
+                positions.insert(index, pos)
+                lengths.insert(index, length)
+            elif valueType in ARRAY_TYPECODES:
+                self.data[name].insert(index, value or 0)
+            else:
+                self.data[name].insert(index, value)
+        self.length += 1
+
+    def append(self, rowData):
+        self.insert(self.length, rowData)
+
+    def extend(self, rowsData):
+        """Appends many rows, extending each column once."""
+        rowsData = list(rowsData)
+        for name, column in self.columns.items():
+            values = [rowData[name].value if name in rowData else None for rowData in rowsData]
+            valueType = column.types.value
+            if valueType == "string":
+                self.data[name].extend(self.__intern(value) for value in values)
+            elif valueType == "blob":
+                positions, lengths = self.data[name]
+                for value in values:
+                    pos, length = self.__encode_blob(name, value)
+                    positions.append(pos)
+                    lengths.append(length)
+            elif valueType in ARRAY_TYPECODES:
+                self.data[name].extend(value or 0 for value in values)
+            else:
+                self.data[name].extend(values)
+        self.length += len(rowsData)
+
+    def pop(self, index: int = -1):
+        row = {name: self.get_value(index, name) for name in self.columns}
+        for name, column in self.columns.items():
+            if column.types.value == "blob":
+                positions, lengths = self.data[name]
+                positions.pop(index)
+                lengths.pop(index)
+            else:
+                self.data[name].pop(index)
+        self.length -= 1
+        return row
+
+    def sort(self, key=None, reverse=False):
+        order = list(range(self.length))
+        if key is not None:
+            keys = [key(UtfRowView(self, i)) for i in order]
+            order.sort(key=keys.__getitem__, reverse=reverse)
+        elif reverse:
+            order.reverse()
+        self.select(order)
+
+    def select(self, rows):
+        """Keeps only the given rows, in the given order."""
+        rows = list(rows)
+        for name, column in self.columns.items():
+            if column.types.value == "blob":
+                positions, lengths = self.data[name]
+                self.data[name] = (array("q", [positions[i] for i in rows]), array("I", [lengths[i] for i in rows]))
+            elif isinstance(self.data[name], array):
+                self.data[name] = array(self.data[name].typecode, [self.data[name][i] for i in rows])
+            else:
+                self.data[name] = [self.data[name][i] for i in rows]
+        self.length = len(rows)
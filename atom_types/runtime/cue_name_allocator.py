@@ -0,0 +1,41 @@
+import re
+from typing import Iterable, List
+
+# ascii digits only: str.isdigit also accepts characters like "²" that int() rejects
+SUFFIX = re.compile("[0-9]+")
+
+
+class CueNameAllocator:
+    """Hands out unused cue names of the form <prefix>_<number>, like MER_BGM_S04_012.
+
+    Remembers the highest number used with each prefix, so new names continue after it.
+    """
+
+    def __init__(self, cue_names: Iterable[str] = (), padding: int = 3):
+        """:param: cue_names: Names that are already in use
+        :param: padding: Minimum number of digits, zero-padded"""
+        self.padding = padding
+        self.highestSuffix = {}
+        for cue_name in cue_names:
+            self.register(cue_name)
+
+    def register(self, cue_name: str):
+        """Marks a name as used, for names that weren't handed out by this allocator."""
+        if not isinstance(cue_name, str):
+            return
+        prefix, separator, suffix = cue_name.rpartition("_")
+        if separator and SUFFIX.fullmatch(suffix):
+            self.highestSuffix[prefix] = max(self.highestSuffix.get(prefix, -1), int(suffix))
+
+    def format(self, prefix: str, number: int) -> str:
+        return f"{prefix}_{str(number).zfill(self.padding)}"
+
+    def next(self, prefix: str) -> str:
+        return self.reserve(prefix, 1)[0]
+
+    def reserve(self, prefix: str, n: int) -> List[str]:
+        """Returns n unused names with the prefix, numbered consecutively."""
+        start = self.highestSuffix.get(prefix, -1) + 1
+        if n > 0:
+            self.highestSuffix[prefix] = start + n - 1
+        return [self.format(prefix, number) for number in range(start, start + n)]
@@ -0,0 +1,109 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class FilePool:
+    """Keeps up to maxOpen files open for reading, closing the least recently used one when another is needed.
+
+    Files are borrowed with borrow(), which locks that one file for the borrower. Files that are borrowed are never
+    closed, so the pool can go over maxOpen for as long as more files than that are borrowed at once.
+    """
+
+    class Handle:
+        def __init__(self, file):
+            self.file = file
+            self.lock = threading.Lock()
+            self.users = 0
+            # closed once the last borrower is done with it
+            self.discarded = False
+
+    def __init__(self, maxOpen: int = 8):
+        self.maxOpen = maxOpen
+        self.handles = OrderedDict()
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.log = logging.getLogger("file_pool")
+
+    def __acquire(self, key: str) -> Handle:
+        with self.lock:
+            handle = self.handles.get(key)
+            if handle is not None:
+                self.handles.move_to_end(key)
+                handle.users += 1
+                return handle
+
+        # opened without holding the pool lock, so slow storage doesn't hold up reads of other files
+        file = open(key, "rb", buffering=0)
+        with self.lock:
+            handle = self.handles.get(key)
+            if handle is None:
+                handle = self.handles[key] = self.Handle(file)
+                self.opened += 1
+                self.log.debug(f"Opened '{key}' ({len(self.handles)} open)")
+            else:
+                # opened by another thread in the meantime
+                file.close()
+                self.handles.move_to_end(key)
+            handle.users += 1
+            return handle
+
+    def __release(self, handle: Handle):
+        with self.lock:
+            handle.users -= 1
+            if handle.discarded and handle.users == 0:
+                handle.file.close()
+            self.__trim()
+
+    def __trim(self):
+        for key in list(self.handles):
+            if len(self.handles) <= self.maxOpen:
+                break
+            handle = self.handles[key]
+            if handle.users == 0:
+                self.handles.pop(key).file.close()
+                self.log.debug(f"Closed '{key}' ({len(self.handles)} open)")
+
+    @contextmanager
+    def borrow(self, path):
+        """Yields the open file at path, for this thread only. Seek before reading."""
+        handle = self.__acquire(os.fspath(path))
+        try:
+            with handle.lock:
+                yield handle.file
+        finally:
+            self.__release(handle)
+
+    def read(self, path, offset: int, length: int) -> bytes:
+        with self.borrow(path) as f:
+            f.seek(offset)
+            data = bytearray()
+            while len(data) < length:
+                chunk = f.read(length - len(data))
+                if not chunk:
+                    break
+                data += chunk
+            return bytes(data)
+
+    def discard(self, path):
+        """Forgets the open file at path, so the next borrow opens it again. Call after replacing the file."""
+        with self.lock:
+            handle = self.handles.pop(os.fspath(path), None)
+            if handle is None:
+                return
+            if handle.users == 0:
+                handle.file.close()
+            else:
+                handle.discarded = True
+            self.log.debug(f"Discarded '{os.fspath(path)}' ({len(self.handles)} open)")
+
+    def close(self):
+        with self.lock:
+            for handle in self.handles.values():
+                handle.file.close()
+            self.handles.clear()
+
+    def __len__(self):
+        return len(self.handles)
@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from atom_types.runtime.util import atomic_write
+
+
+def user_cache_dir() -> Path:
+    """Directory for files that only save work between runs: %LOCALAPPDATA% on Windows, $XDG_CACHE_HOME or
+    ~/.cache elsewhere."""
+    if os.name == "nt" and os.environ.get("LOCALAPPDATA"):
+        base = Path(os.environ["LOCALAPPDATA"])
+    elif os.environ.get("XDG_CACHE_HOME"):
+        base = Path(os.environ["XDG_CACHE_HOME"])
+    else:
+        base = Path.home() / ".cache"
+    return base / "wacca-acb-editor"
+
+
+class HashCache:
+    """MD5 digests of files, saved to disk so unchanged files aren't hashed again in later runs.
+
+    A digest is only used while the file still has the same size, modification time and inode. The cache file can
+    be deleted at any time, everything is just hashed again. Safe to use from several threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.changed = False
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.log = logging.getLogger("hash_cache")
+        self.load()
+
+    @staticmethod
+    def key(path) -> str:
+        return os.path.realpath(path)
+
+    @staticmethod
+    def stamp(path) -> list:
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+            self.log.debug(f"Loaded {len(self.entries)} hashes from '{self.path}'")
+        except FileNotFoundError:
+            self.entries = {}
+        except (OSError, ValueError) as e:
+            self.log.warning(f"Ignoring unreadable hash cache '{self.path}': {e}")
+            self.entries = {}
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # a crash never leaves half a cache
+            with atomic_write(self.path, "w") as f:
+                json.dump(self.entries, f, indent=1)
+            self.changed = False
+
+    def get(self, path) -> Optional[bytes]:
+        """Returns the digest of the file at path, or None if it isn't known or the file changed."""
+        stamp = self.stamp(path)
+        with self.lock:
+            entry = self.entries.get(self.key(path))
+            if entry is not None and entry["stamp"] == stamp:
+                self.hits += 1
+                self.log.debug(f"Hash cache hit for '{path}'")
+                return bytes.fromhex(entry["md5"])
+            self.misses += 1
+        self.log.debug(f"Hash cache miss for '{path}'")
+        return None
+
+    def put(self, path, digest: bytes):
+        """Remembers the digest of the file at path as it is now."""
+        entry = {"stamp": self.stamp(path), "md5": digest.hex()}
+        with self.lock:
+            self.entries[self.key(path)] = entry
+            self.changed = True
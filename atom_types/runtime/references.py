@@ -0,0 +1,317 @@
+import logging
+import struct
+from array import array
+from typing import Dict, List, Tuple
+
+from atom_types.runtime import util
+
+# AwbTables attribute of every layer, in reference order. Each layer references rows of the next one, and
+# waveforms reference AWB entries.
+LAYERS = ("cues", "sequences", "tracks", "trackEvents", "synths", "waveforms")
+AWB_ENTRIES = "awbEntries"
+
+# ReferenceType of cues that play a sequence
+CUE_REFERENCE_SEQUENCE = 3
+# TrackEvent command that plays a reference item, and the item type of synths
+COMMAND_NOTE_ON = 2000
+ITEM_TYPE_SYNTH = 2
+# ReferenceItems item type of waveforms
+ITEM_TYPE_WAVEFORM = 1
+
+
+def awb_entry_key(port: int, file_id: int) -> int:
+    return (port << 16) | (file_id & 0xffff)
+
+
+def awb_entry(key: int) -> Tuple[int, int]:
+    """Returns the (StreamAwbPortNo, StreamAwbId) of an AWB entry key."""
+    return key >> 16, key & 0xffff
+
+
+def read_blob(blob) -> bytes:
+    if blob is None or not blob.length:
+        return b""
+    return blob.read()
+
+
+def decode_track_events(command: bytes) -> Tuple[int, ...]:
+    """Returns the synth indices played by a TrackEvent command blob."""
+    synths = []
+    pos = 0
+    while pos + 3 <= len(command):
+        code, size = struct.unpack_from(">HB", command, pos)
+        pos += 3
+        if code == COMMAND_NOTE_ON and size >= 4:
+            itemType, index = struct.unpack_from(">hh", command, pos)
+            if itemType == ITEM_TYPE_SYNTH:
+                synths.append(index)
+        pos += size
+    return tuple(synths)
+
+
+def decode_reference_items(items: bytes) -> Tuple[int, ...]:
+    """Returns the waveform indices of a Synth ReferenceItems blob."""
+    count = len(items) // 4
+    values = struct.unpack(f">{count * 2}H", items[:count * 4])
+    return tuple(index for itemType, index in zip(values[0::2], values[1::2]) if itemType == ITEM_TYPE_WAVEFORM)
+
+
+def remap_track_events(command: bytes, remap) -> bytes:
+    """Rewrites the synth indices in a TrackEvent command blob.
+
+    :param: remap: New index of every synth
+    :raises ValueError: If the command plays something other than a synth
+    """
+    data = bytearray(command)
+    pos = 0
+    while pos + 3 <= len(data):
+        code, size = struct.unpack_from(">HB", data, pos)
+        pos += 3
+        if code == COMMAND_NOTE_ON and size >= 4:
+            itemType, index = struct.unpack_from(">hh", data, pos)
+            if itemType != ITEM_TYPE_SYNTH:
+                raise ValueError(f"Track event command plays an item of type {itemType}, which isn't supported.")
+            struct.pack_into(">h", data, pos + 2, remap[index])
+        pos += size
+    return bytes(data)
+
+
+def remap_reference_items(items: bytes, remap) -> bytes:
+    """Rewrites the waveform indices in a Synth ReferenceItems blob.
+
+    :param: remap: New index of every waveform
+    :raises ValueError: If the synth references something other than a waveform
+    """
+    count = len(items) // 4
+    values = list(struct.unpack(f">{count * 2}H", items[:count * 4]))
+    for i in range(0, len(values), 2):
+        if values[i] != ITEM_TYPE_WAVEFORM:
+            raise ValueError(f"Synth references an item of type {values[i]}, which isn't supported.")
+        values[i + 1] = remap[values[i + 1]]
+    return struct.pack(f">{count * 2}H", *values) + items[count * 4:]
+
+
+class Adjacency:
+    """Rows of variable-length integer lists, stored as two flat arrays: the values of every row one after the
+    other, and the offset where each row starts."""
+
+    def __init__(self, rows=(), typecode: str = "i"):
+        self.offsets = array("I", [0])
+        self.values = array(typecode)
+        for targets in rows:
+            self.append(targets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> Tuple[int, ...]:
+        return tuple(self.values[self.offsets[row]:self.offsets[row + 1]])
+
+    def __setitem__(self, row: int, targets: Tuple[int, ...]):
+        start, end = self.offsets[row], self.offsets[row + 1]
+        self.values[start:end] = array(self.values.typecode, targets)
+        self.__shift_offsets(row + 1, len(targets) - (end - start))
+
+    def __shift_offsets(self, start: int, delta: int):
+        if delta:
+            for i in range(start, len(self.offsets)):
+                self.offsets[i] += delta
+
+    def append(self, targets: Tuple[int, ...]):
+        self.values.extend(targets)
+        self.offsets.append(len(self.values))
+
+    def insert(self, row: int, targets: Tuple[int, ...]):
+        start = self.offsets[row]
+        self.values[start:start] = array(self.values.typecode, targets)
+        self.offsets.insert(row, start)
+        self.__shift_offsets(row + 1, len(targets))
+
+    def pop(self, row: int) -> Tuple[int, ...]:
+        targets = self[row]
+        start, end = self.offsets[row], self.offsets[row + 1]
+        del self.values[start:end]
+        del self.offsets[row + 1]
+        self.__shift_offsets(row + 1, start - end)
+        return targets
+
+    def rows(self) -> List[Tuple[int, ...]]:
+        return [self[row] for row in range(len(self))]
+
+
+class ReferenceGraph:
+    """Index of the references between the ACB tables, from cues down to AWB entries and back.
+
+    The rows each row of a layer references in the next layer are kept in an Adjacency (forward), and every
+    layer maps row indices to an array of the rows of the previous layer that reference them (reverse). AWB entries are
+    keyed by awb_entry_key(StreamAwbPortNo, StreamAwbId).
+
+    The graph registers itself as a listener of the tables, so it follows add/insert/update/pop instead of
+    being rebuilt. References hold the raw index values, which the tables don't renumber when rows are
+    removed either, so a change to a table only touches its own forward references and the reverse
+    references of the layer below it.
+    """
+
+    def __init__(self, tables):
+        """:param: tables: AwbTables"""
+        self.log = logging.getLogger("references")
+        self.tables = tables
+        self.forward: Dict[str, Adjacency] = {}
+        self.reverse: Dict[str, Dict[int, array]] = {layer: {} for layer in LAYERS[1:] + (AWB_ENTRIES,)}
+        self.layerByTable = {}
+
+        for layer in LAYERS:
+            table = getattr(tables, layer)
+            self.layerByTable[id(table)] = layer
+            self.__build_layer(layer)
+            table.listeners.append(self)
+        self.log.debug(f"Built reference graph: {', '.join(f'{len(self.forward[l])} {l}' for l in LAYERS)}")
+
+    @staticmethod
+    def child_of(layer: str) -> str:
+        index = LAYERS.index(layer)
+        return LAYERS[index + 1] if index + 1 < len(LAYERS) else AWB_ENTRIES
+
+    @staticmethod
+    def parent_of(layer: str) -> str:
+        index = LAYERS.index(layer) if layer != AWB_ENTRIES else len(LAYERS)
+        return LAYERS[index - 1] if index > 0 else None
+
+    @staticmethod
+    def __values(utf, name: str, rows: range, default=None):
+        if name not in utf.columns:
+            return [default] * len(rows)
+        elif len(rows) == len(utf.rows):
+            return utf.column(name)
+        return [utf.get(row, name) for row in rows]
+
+    def __decode_rows(self, layer: str, start: int = 0, stop: int = None) -> List[Tuple[int, ...]]:
+        """Decodes the forward references of rows [start, stop) of a layer."""
+        utf = getattr(self.tables, layer).utf
+        rows = range(start, len(utf.rows) if stop is None else stop)
+        if layer == "cues":
+            types = self.__values(utf, "ReferenceType", rows, CUE_REFERENCE_SEQUENCE)
+            indices = self.__values(utf, "ReferenceIndex", rows)
+            return [(util.i16swap(index),) if index is not None and referenceType == CUE_REFERENCE_SEQUENCE else ()
+                    for referenceType, index in zip(types, indices)]
+        elif layer == "sequences":
+            result = []
+            for blob in self.__values(utf, "TrackIndex", rows):
+                data = read_blob(blob)
+                result.append(struct.unpack(f">{len(data) // 2}h", data[:len(data) // 2 * 2]))
+            return result
+        elif layer == "tracks":
+            # -1 means the track has no event
+            return [(util.i16swap(index),) if index is not None and util.i16swap(index) >= 0 else ()
+                    for index in self.__values(utf, "EventIndex", rows)]
+        elif layer == "trackEvents":
+            return [decode_track_events(read_blob(blob)) for blob in self.__values(utf, "Command", rows)]
+        elif layer == "synths":
+            return [decode_reference_items(read_blob(blob)) for blob in self.__values(utf, "ReferenceItems", rows)]
+        else:
+            ports = self.__values(utf, "StreamAwbPortNo", rows)
+            fileIds = self.__values(utf, "StreamAwbId", rows)
+            # -1 is a waveform that isn't streamed
+            return [(awb_entry_key(util.i16swap(port), util.i16swap(fileId)),)
+                    if port is not None and fileId is not None and util.i16swap(fileId) >= 0 else ()
+                    for port, fileId in zip(ports, fileIds)]
+
+    def __build_layer(self, layer: str):
+        reverse = self.reverse[self.child_of(layer)]
+        reverse.clear()
+        rows = self.__decode_rows(layer)
+        # AWB entry keys can take more than 31 bits
+        self.forward[layer] = Adjacency(rows, "q" if layer == "waveforms" else "i")
+        for row, targets in enumerate(rows):
+            for target in targets:
+                reverse.setdefault(target, array("i")).append(row)
+
+    def __link(self, layer: str, row: int, targets: Tuple[int, ...]):
+        reverse = self.reverse[self.child_of(layer)]
+        for target in targets:
+            reverse.setdefault(target, array("i")).append(row)
+
+    def __unlink(self, layer: str, row: int, targets: Tuple[int, ...]):
+        reverse = self.reverse[self.child_of(layer)]
+        for target in targets:
+            sources = reverse[target]
+            sources.remove(row)
+            if not sources:
+                del reverse[target]
+
+    def __shift(self, layer: str, start: int, delta: int):
+        """Renumbers the reverse references to rows of a layer from start on, after rows were inserted or removed."""
+        for sources in self.reverse[self.child_of(layer)].values():
+            for i, row in enumerate(sources):
+                if row >= start:
+                    sources[i] = row + delta
+
+    def table_changed(self, table, event: str, index: int):
+        layer = self.layerByTable[id(table)]
+        forward = self.forward[layer]
+        if index < 0:
+            # negative indices as passed to list.pop/insert
+            index = max(0, index + len(forward))
+        if event == "appended":
+            for row, targets in enumerate(self.__decode_rows(layer, index), index):
+                forward.append(targets)
+                self.__link(layer, row, targets)
+        elif event == "inserted":
+            index = min(index, len(forward))
+            self.__shift(layer, index, 1)
+            targets = self.__decode_rows(layer, index, index + 1)[0]
+            forward.insert(index, targets)
+            self.__link(layer, index, targets)
+        elif event == "removed":
+            self.__unlink(layer, index, forward.pop(index))
+            self.__shift(layer, index + 1, -1)
+        elif event == "updated":
+            self.__unlink(layer, index, forward[index])
+            forward[index] = self.__decode_rows(layer, index, index + 1)[0]
+            self.__link(layer, index, forward[index])
+        else:
+            self.__build_layer(layer)
+
+    def targets(self, layer: str, index: int) -> Tuple[int, ...]:
+        """Rows of the next layer referenced by a row (AWB entry keys for waveforms)."""
+        return self.forward[layer][index]
+
+    def sources(self, layer: str, index: int) -> List[int]:
+        """Rows of the previous layer that reference a row (or an AWB entry key)."""
+        return list(self.reverse[layer].get(index, ()))
+
+    def descendants(self, layer: str, index: int, to_layer: str) -> List[int]:
+        """Follows references from a row down to to_layer, returning unique rows in the order they're reached."""
+        rows = [index]
+        while layer != to_layer:
+            forward = self.forward[layer]
+            rows = list(dict.fromkeys(target for row in rows if 0 <= row < len(forward) for target in forward[row]))
+            layer = self.child_of(layer)
+        return rows
+
+    def ancestors(self, layer: str, index: int, to_layer: str) -> List[int]:
+        """Follows references from a row (or AWB entry key) up to to_layer, returning unique rows."""
+        rows = [index]
+        while layer != to_layer:
+            reverse = self.reverse[layer]
+            rows = list(dict.fromkeys(source for row in rows for source in reverse.get(row, ())))
+            layer = self.parent_of(layer)
+        return rows
+
+    def awb_entries_for_cue(self, cue_index: int) -> List[Tuple[int, int]]:
+        """(StreamAwbPortNo, StreamAwbId) of every AWB entry a cue plays.
+
+        :param: cue_index: Index of the Cue in CueTable (NOT 'CueId')
+        """
+        return [awb_entry(key) for key in self.descendants("cues", cue_index, AWB_ENTRIES)]
+
+    def waveforms_for_cue(self, cue_index: int) -> List[int]:
+        return self.descendants("cues", cue_index, "waveforms")
+
+    def cues_for_waveform(self, waveform_index: int) -> List[int]:
+        """Indices of the Cues that play a waveform."""
+        return self.ancestors("waveforms", waveform_index, "cues")
+
+    def cues_for_awb_entry(self, port: int, file_id: int) -> List[int]:
+        """Indices of the Cues that play an AWB entry."""
+        return self.ancestors(AWB_ENTRIES, awb_entry_key(port, file_id), "cues")
@@ -0,0 +1,192 @@
+import struct
+
+# Byte order and struct format for each value type, mirroring UtfField.
+# Signed integers and floats are read little-endian, everything else big-endian.
+VALUE_FORMATS = {
+    "int8": ("<", "b"),
+    "uint8": (">", "B"),
+    "int16": ("<", "h"),
+    "uint16": (">", "H"),
+    "int32": ("<", "i"),
+    "uint32": (">", "I"),
+    "int64": ("<", "q"),
+    "uint64": (">", "Q"),
+    "float": ("<", "f"),
+    "double": ("<", "d"),
+    "string": (">", "I"),
+    "blob": (">", "II"),
+    "guid": (">", "16s"),
+}
+
+# these are big-endian :(
+BIG_ENDIAN_COLUMNS = ("ControlWorkArea1", "ControlWorkArea2")
+
+COLUMN_TYPE_NIBBLES = {"constant": 0x3, "variable": 0x5}
+
+VALUE_TYPE_NIBBLES = {
+    "int8": 0x00,
+    "uint8": 0x01,
+    "int16": 0x02,
+    "uint16": 0x03,
+    "int32": 0x04,
+    "uint32": 0x05,
+    "int64": 0x06,
+    "uint64": 0x07,
+    "float": 0x08,
+    "double": 0x09,
+    "string": 0x0a,
+    "blob": 0x0b,
+    "guid": 0x0c,
+}
+
+
+def value_size(valueType) -> int:
+    order, fmt = VALUE_FORMATS[str(valueType)]
+    return struct.calcsize(order + fmt)
+
+
+def pack_value(buffer, offset: int, valueType, value):
+    """Packs a single field (like a column constant) into buffer. Strings are packed as their pointer and
+    blobs as a (pointer, length) pair."""
+    order, fmt = VALUE_FORMATS[str(valueType)]
+    if str(valueType) == "blob":
+        struct.pack_into(order + fmt, buffer, offset, *value)
+    else:
+        struct.pack_into(order + fmt, buffer, offset, value)
+
+
+class RowFormat:
+    """Compiles the variable columns of a table into a pair of struct.Struct row formats.
+
+    A row mixes little and big-endian fields, so it is described by two structs of the same size: one that only
+    unpacks the little-endian fields and one that only unpacks the big-endian fields, each skipping over the other's
+    bytes with padding. Unpacking a row region with both and zipping the results yields every field of every row
+    without going through construct.
+    """
+
+    def __init__(self, columns):
+        littleFormat = ["<"]
+        bigFormat = [">"]
+        littleCount = 0
+        bigCount = 0
+        # (column name, value type, byte order, index into the unpacked tuple of that byte order)
+        self.fields = []
+        # offset of each field in a row
+        self.offsets = []
+        offset = 0
+
+        for column in columns:
+            valueType = str(column.types.value)
+            order, fmt = VALUE_FORMATS[valueType]
+            if column.name in BIG_ENDIAN_COLUMNS:
+                # read as little-endian and swapped back by the construct path, so read as big-endian here
+                order = ">"
+            size = struct.calcsize(">" + fmt)
+            self.offsets.append(offset)
+            offset += size
+            if order == "<":
+                self.fields.append((column.name, valueType, order, littleCount))
+                littleFormat.append(fmt)
+                bigFormat.append(f"{size}x")
+                littleCount += len(fmt) if valueType == "blob" else 1
+            else:
+                self.fields.append((column.name, valueType, order, bigCount))
+                bigFormat.append(fmt)
+                littleFormat.append(f"{size}x")
+                bigCount += len(fmt) if valueType == "blob" else 1
+
+        self.little = struct.Struct("".join(littleFormat))
+        self.big = struct.Struct("".join(bigFormat))
+        self.size = self.little.size
+
+    def iter_unpack(self, buffer):
+        """Yields one tuple of raw field values per row, in column order.
+
+        String fields are string pool pointers and blob fields are (pointer, length) pairs.
+        """
+        if self.size == 0:
+            return
+        getters = []
+        for name, valueType, order, index in self.fields:
+            getters.append((order == ">", valueType == "blob", index))
+
+        for little, big in zip(self.little.iter_unpack(buffer), self.big.iter_unpack(buffer)):
+            values = []
+            for isBig, isBlob, index in getters:
+                source = big if isBig else little
+                values.append((source[index], source[index + 1]) if isBlob else source[index])
+            yield values
+
+    def pack_rows(self, buffer, offset: int, columnValues):
+        """Packs rows into buffer, one column at a time.
+
+        Each column is packed with a single struct call and then scattered into its place in every row.
+        Strings have to be given as pointers and blobs as (pointer, length) pairs.
+
+        :param: columnValues: One sequence of values per field, in column order
+        """
+        rowCount = len(columnValues[0]) if columnValues else 0
+        if self.size == 0 or rowCount == 0:
+            return
+        rows = memoryview(buffer)[offset:offset + self.size * rowCount]
+
+        for (name, valueType, _, _), fieldOffset, values in zip(self.fields, self.offsets, columnValues):
+            # written in the byte order of the value type: ControlWorkArea1/2 are only swapped on read
+            order, fmt = VALUE_FORMATS[valueType]
+            if valueType == "blob":
+                data = struct.pack(f"{order}{rowCount * 2}I", *(x for pair in values for x in pair))
+            elif valueType == "guid":
+                data = b"".join(values)
+            else:
+                data = struct.pack(f"{order}{rowCount}{fmt}", *values)
+
+            size = len(data) // rowCount
+            for i in range(size):
+                rows[fieldOffset + i::self.size] = data[i::size]
+
+
+class StringPoolWriter:
+    """Builds the string area of a table.
+
+    In compact mode identical strings share a single copy, otherwise every string is written out again.
+    """
+
+    def __init__(self, compact: bool = False):
+        self.data = bytearray()
+        self.compact = compact
+        self.pointers = {}
+        self.bytesSaved = 0
+
+    def add(self, value: str) -> int:
+        if self.compact:
+            try:
+                pointer = self.pointers[value]
+                self.bytesSaved += len(value.encode("utf8")) + 1
+                return pointer
+            except KeyError:
+                pass
+        pointer = len(self.data)
+        self.data += value.encode("utf8") + b"\x00"
+        if self.compact:
+            self.pointers[value] = pointer
+        return pointer
+
+
+class StringPool:
+    """Decodes NUL-terminated strings out of a table's string area, caching them by pointer."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.cache = {}
+
+    def get(self, pointer: int):
+        try:
+            return self.cache[pointer]
+        except KeyError:
+            end = self.data.find(b"\x00", pointer)
+            if end < 0:
+                value = None
+            else:
+                value = self.data[pointer:end].decode("utf8")
+            self.cache[pointer] = value
+            return value
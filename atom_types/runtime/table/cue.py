@@ -1,8 +1,9 @@
 from collections import OrderedDict
+from typing import List, Tuple
 
 from atom_types.runtime import util
 from atom_types.file.utf_file import ValueTypeNibble
-from atom_types.runtime.table.table_base import TableBase
+from atom_types.runtime.table.table_base import TableBase, modifies
 from atom_types.runtime.utf import UtfRowCell
 
 
@@ -15,35 +16,111 @@ def create_row(cue_id: int, reference_index: int, length_ms: int):
 
 
 class CueTable(TableBase):
+    def __init__(self, utf):
+        super().__init__(utf)
+        # cue IDs (native endianness) in use or handed out by reserve(), built on first use
+        self.__usedCueIds = None
+        self.__reservedCueIds = set()
+        # where the search for an unused cue ID starts: one past the last row's cue ID
+        self.__nextCueId = 0
+
+    def __build_cue_ids(self):
+        # the value in the parsed row structure is big-endian read in as little-endian
+        # we need to swap endianness to compare
+        self.__usedCueIds = set(util.i32swap(cueId) for cueId in self.utf.column("CueId"))
+        self.__reset_next_cue_id()
+
+    def __reset_next_cue_id(self):
+        cueIds = self.utf.column("CueId")
+        self.__nextCueId = util.i32swap(cueIds[-1]) + 1 if len(cueIds) > 0 else 0
+
+    def __is_free(self, cue_id: int):
+        return cue_id not in self.__usedCueIds and cue_id not in self.__reservedCueIds
+
     def __search(self, cue_id: int):
         try:
             cue_id_be = util.i32swap(cue_id)
-            return next(filter(lambda x: x[1]["CueId"].value == cue_id_be, enumerate(self.utf.rows)))[0]
-        except StopIteration:
+            return self.utf.column("CueId").index(cue_id_be)
+        except ValueError:
             # Note that this is not the index of the cue, but the value of the CueId column.
             raise KeyError(f"Cue ID '{cue_id}' does not exist in Cue list.")
 
     def __get_next_cue_id(self):
-        cueId = 0
-        if len(self.utf.rows) > 0:
-            # grab last row and start adding until we hit an unused cue ID
-            # the value in the parsed row structure is big-endian read in as little-endian
-            # we need to swap endianness to compare
-            cueId = util.i32swap(self.utf.rows[-1]["CueId"].value) + 1
-            while util.i32swap(cueId) in [r["CueId"].value for r in self.utf.rows]:
-                cueId = cueId + 1
+        if self.__usedCueIds is None:
+            self.__build_cue_ids()
+        # start after the last row and keep adding until we hit an unused cue ID
+        cueId = self.__nextCueId
+        while not self.__is_free(cueId):
+            cueId = cueId + 1
         return cueId
 
+    def reserve(self, n: int) -> range:
+        """Reserves n consecutive unused cue IDs, to be passed to add() later.
+
+        :param: n: Number of cue IDs to reserve
+        """
+        if self.__usedCueIds is None:
+            self.__build_cue_ids()
+        start = self.__get_next_cue_id()
+        end = start
+        while end - start < n:
+            if self.__is_free(end):
+                end += 1
+            else:
+                start = end = end + 1
+        self.__reservedCueIds.update(range(start, end))
+        return range(start, end)
+
+    def mark_dirty(self):
+        super().mark_dirty()
+        self.__usedCueIds = None
+
+    @modifies
     def update(self, cue_id: int, reference_index: int, length: int):
         index = self.__search(cue_id)
         self.utf.rows[index]["ReferenceIndex"].value = util.i16swap(reference_index)
         self.utf.rows[index]["Length"].value = util.i32swap(length)
+        self.notify("updated", index)
 
-    def add(self, reference_index: int, length_ms: int):
-        cue_id = self.__get_next_cue_id()
+    @modifies
+    def add(self, reference_index: int, length_ms: int, cue_id: int = None):
+        """:param: cue_id: Cue ID from reserve() to use instead of the next unused one"""
+        if cue_id is None:
+            cue_id = self.__get_next_cue_id()
+        elif self.__usedCueIds is None:
+            self.__build_cue_ids()
+        if cue_id in self.__usedCueIds:
+            raise KeyError(f"Cue ID '{cue_id}' already exists in Cue list.")
         self.utf.rows.append(create_row(cue_id, reference_index, length_ms))
+        self.__usedCueIds.add(cue_id)
+        self.__reservedCueIds.discard(cue_id)
+        self.__nextCueId = cue_id + 1
+        self.notify("appended", len(self.utf.rows) - 1)
         return len(self.utf.rows) - 1
 
+    @modifies
+    def add_many(self, cues: List[Tuple[int, int]]) -> range:
+        """Appends one row per (reference_index, length_ms), with consecutive cue IDs from reserve().
+        Returns the new row indices."""
+        cues = list(cues)
+        cueIds = self.reserve(len(cues))
+        start = len(self.utf.rows)
+        self.utf.rows.extend([create_row(cue_id, reference_index, length_ms)
+                              for cue_id, (reference_index, length_ms) in zip(cueIds, cues)])
+        self.__usedCueIds.update(cueIds)
+        self.__reservedCueIds.difference_update(cueIds)
+        if cues:
+            self.__nextCueId = cueIds[-1] + 1
+        self.notify("appended", start)
+        return range(start, len(self.utf.rows))
+
+    @modifies
     def pop(self, cue_id: int):
         index = self.__search(cue_id)
         self.utf.rows.pop(index)
+        self.notify("removed", index)
+        if self.__usedCueIds is not None:
+            self.__usedCueIds.discard(cue_id)
+            if index == len(self.utf.rows):
+                # the last row went away, so the search starts after the new last row again
+                self.__reset_next_cue_id()
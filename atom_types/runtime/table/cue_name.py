@@ -1,66 +1,242 @@
+from array import array
+from bisect import bisect_left, bisect_right, insort
 from collections import OrderedDict
+from typing import Dict, List, Sequence, Tuple
 
 from atom_types.runtime import util
 from atom_types.file.utf_file import ValueTypeNibble
-from atom_types.runtime.table.table_base import TableBase
+from atom_types.runtime.table.table_base import TableBase, modifies
 from atom_types.runtime.utf import UtfRowCell
 
 
+def name_key(row):
+    return row['CueName'].value
+
+
 class CueNameTable(TableBase):
+    """Cue names, kept sorted by name (as the game expects) so lookups by name are binary searches.
+
+    Lookups never move rows. If the parsed rows aren't sorted, lookups go through a sorted permutation of the row
+    indices instead, and the rows are only sorted by the first method that changes the table.
+    """
+
+    def __init__(self, utf):
+        super().__init__(utf)
+        # every cue name in sorted order, built on first use
+        self.__names = None
+        # row index of every name in __names, or None while the rows are sorted (row index == position)
+        self.__order = None
+        # sorted cue names by (byte-swapped) cue index, built on the first lookup by cue index. Kept up to date by
+        # every change after that
+        self.__namesByCueIndex: Dict[int, List[str]] = None
+
+    def __sorted_names(self) -> List[str]:
+        if self.__names is None:
+            names = list(self.utf.column("CueName"))
+            self.__order = None
+            if any(a > b for a, b in zip(names, names[1:])):
+                # stable, so rows with the same name keep their order
+                self.__order = array("i", sorted(range(len(names)), key=names.__getitem__))
+                names = [names[i] for i in self.__order]
+            self.__names = names
+        return self.__names
+
+    def __row(self, position: int) -> int:
+        """Row index of the name at a position of __names."""
+        return position if self.__order is None else self.__order[position]
+
+    def __sort_rows(self):
+        """Sorts the rows if they aren't sorted yet. Called before changing the table, never by lookups."""
+        self.__sorted_names()
+        if self.__order is not None:
+            self.utf.select_rows(self.__order)
+            self.__order = None
+            self.notify("reset")
+
+    def __invalidate_indexes(self):
+        self.__names = None
+        self.__order = None
+        self.__namesByCueIndex = None
+
     def __search_name(self, cue_name: str) -> int:
-        try:
-            return next(filter(lambda x: x[1]["CueName"].value == cue_name, enumerate(self.utf.rows)))[0]
-        except StopIteration:
-            raise KeyError(f"Cue name '{cue_name}' does not exist in Cue Name list.")
+        names = self.__sorted_names()
+        index = bisect_left(names, cue_name)
+        if index < len(names) and names[index] == cue_name:
+            return self.__row(index)
+        raise KeyError(f"Cue name '{cue_name}' does not exist in Cue Name list.")
 
     def __search_cue_index(self, cue_index: int) -> int:
-        try:
-            cue_index_be = util.i16swap(cue_index)
-            return next(filter(lambda x: x[1]["CueIndex"].value == cue_index_be, enumerate(self.utf.rows)))[0]
-        except StopIteration:
+        if self.__namesByCueIndex is None:
+            self.__namesByCueIndex = {}
+            for name, cue_index_be in zip(self.utf.column("CueName"), self.utf.column("CueIndex")):
+                self.__namesByCueIndex.setdefault(cue_index_be, []).append(name)
+            for names in self.__namesByCueIndex.values():
+                names.sort()
+        names = self.__namesByCueIndex.get(util.i16swap(cue_index))
+        if not names:
             raise KeyError(f"Cue index '{cue_index}' does not exist in Cue Name list.")
+        # first row wins, same as searching the rows in order
+        if self.__order is None:
+            return self.__search_name(names[0])
+        return min(self.__search_name(name) for name in names)
+
+    def __link_cue_index(self, cue_index_be: int, cue_name: str):
+        if self.__namesByCueIndex is not None:
+            insort(self.__namesByCueIndex.setdefault(cue_index_be, []), cue_name)
+
+    def __unlink_cue_index(self, cue_index_be: int, cue_name: str):
+        if self.__namesByCueIndex is not None:
+            names = self.__namesByCueIndex[cue_index_be]
+            names.remove(cue_name)
+            if not names:
+                del self.__namesByCueIndex[cue_index_be]
 
+    def __contains__(self, cue_name: str):
+        names = self.__sorted_names()
+        index = bisect_left(names, cue_name)
+        return index < len(names) and names[index] == cue_name
+
+    def __create_row(self, cue_index_be: int, cue_name: str):
+        return OrderedDict([
+            UtfRowCell.build_tuple("CueName", cue_name, ValueTypeNibble.string),
+            UtfRowCell.build_tuple("CueIndex", cue_index_be, ValueTypeNibble.int16),
+        ])
+
+    def __prefix_positions(self, prefix: str) -> range:
+        names = self.__sorted_names()
+        start = bisect_left(names, prefix)
+        if not prefix:
+            return range(start, len(names))
+        # first name after every name with the prefix
+        end = bisect_left(names, prefix[:-1] + chr(ord(prefix[-1]) + 1), start)
+        return range(start, end)
+
+    def prefix_range(self, prefix: str) -> Sequence[int]:
+        """Row indices of every cue name starting with prefix, like all 'MER_BGM_S04_' cues, in name order. A range,
+        unless the parsed rows weren't sorted and nothing changed them yet."""
+        positions = self.__prefix_positions(prefix)
+        if self.__order is None:
+            return positions
+        return [self.__order[position] for position in positions]
+
+    def names_with_prefix(self, prefix: str) -> List[str]:
+        positions = self.__prefix_positions(prefix)
+        return self.__sorted_names()[positions.start:positions.stop]
+
+    def mark_dirty(self):
+        super().mark_dirty()
+        self.__invalidate_indexes()
+
+    @modifies
     def update(self, search_cue_name: str, new_cue_index: int):
         """Updates the Cue index based on Cue name.
 
         :param: search_cue_name: Cue name to search for
         :param: new_cue_index: New index of the Cue in CueTable (NOT 'CueId')
         """
+        self.__sort_rows()
         index = self.__search_name(search_cue_name)
         # self.utf.rows[index]["CueName"].value = cue_name
+        self.__unlink_cue_index(self.utf.rows[index]["CueIndex"].value, search_cue_name)
         self.utf.rows[index]["CueIndex"].value = util.i16swap(new_cue_index)
+        self.__link_cue_index(util.i16swap(new_cue_index), search_cue_name)
+        self.notify("updated", index)
 
+    @modifies
     def update_by_cue_index(self, search_cue_index: int, new_cue_name: str):
         """Updates the Cue name based on Cue index.
 
         :param: search_cue_index: Index of the Cue in CueTable (NOT 'CueId') to search for
         :param: new_cue_name: New Cue name
         """
+        self.__sort_rows()
         index = self.__search_cue_index(search_cue_index)
+        names = self.__sorted_names()
+        cue_index_be = util.i16swap(search_cue_index)
+        self.__unlink_cue_index(cue_index_be, names.pop(index))
         self.utf.rows[index]["CueName"].value = new_cue_name
+        self.__link_cue_index(cue_index_be, new_cue_name)
+        self.notify("updated", index)
+
+        # moves the row to its new place
+        newIndex = bisect_right(names, new_cue_name)
+        names.insert(newIndex, new_cue_name)
+        if newIndex != index:
+            order = list(range(len(names)))
+            order.insert(newIndex, order.pop(index))
+            self.utf.select_rows(order)
+            self.notify("removed", index)
+            self.notify("inserted", newIndex)
 
+    @modifies
     def add(self, cue_index: int, cue_name: str):
-        """Adds a new row to the Cue Name list.
+        """Adds a new row to the Cue Name list, in its sorted place.
 
         :param: cue_index: Index of the Cue in CueTable (NOT 'CueId')
         :param: cue_name: Unique name to associate with the Cue
+        :returns: Row index of the new row
         """
-        if cue_name in [row["CueName"].value for row in self.utf.rows]:
+        if cue_name in self:
             raise KeyError(f"Cue name '{cue_name}' already present in Cue Name list.")
-        row = OrderedDict([
-            UtfRowCell.build_tuple("CueName", cue_name, ValueTypeNibble.string),
-            UtfRowCell.build_tuple("CueIndex", util.i16swap(cue_index), ValueTypeNibble.int16),
-        ])
-        self.utf.rows.append(row)
-        return len(self.utf.rows) - 1
+        self.__sort_rows()
+        names = self.__sorted_names()
+        cue_index_be = util.i16swap(cue_index)
+        index = bisect_right(names, cue_name)
+        self.utf.rows.insert(index, self.__create_row(cue_index_be, cue_name))
+        names.insert(index, cue_name)
+        self.__link_cue_index(cue_index_be, cue_name)
+        self.notify("inserted", index)
+        return index
+
+    @modifies
+    def add_many(self, cue_names: List[Tuple[int, str]]) -> List[int]:
+        """Adds one row per (cue_index, cue_name), keeping the rows sorted.
+        Nothing is added if any of the names is already present.
+
+        :returns: Row index of every new row, in the order they were given
+        """
+        added = {}
+        for cue_index, cue_name in cue_names:
+            if cue_name in self or cue_name in added:
+                raise KeyError(f"Cue name '{cue_name}' already present in Cue Name list.")
+            added[cue_name] = util.i16swap(cue_index)
+        self.__sort_rows()
+        names = self.__sorted_names()
+
+        # append the new rows sorted, then merge the two sorted runs (the sort is stable and linear for this)
+        start = len(self.utf.rows)
+        newNames = sorted(added)
+        self.utf.rows.extend([self.__create_row(added[cue_name], cue_name) for cue_name in newNames])
+        names.extend(newNames)
+        order = sorted(range(len(names)), key=names.__getitem__)
+        if order[start:] != list(range(start, len(names))):
+            self.utf.select_rows(order)
+            self.__names = [names[i] for i in order]
+        for cue_name, cue_index_be in added.items():
+            self.__link_cue_index(cue_index_be, cue_name)
+        self.notify("reset")
+        return [bisect_left(self.__names, cue_name) for cue_name in added]
 
+    @modifies
     def pop(self, cue_name: str):
         """Removes a Cue Name from the list.
 
         :param: cue_name: Cue Name to remove
         """
+        self.__sort_rows()
         index = self.__search_name(cue_name)
+        self.__unlink_cue_index(self.utf.rows[index]["CueIndex"].value, cue_name)
         self.utf.rows.pop(index)
+        self.__names.pop(index)
+        self.notify("removed", index)
+
+    @modifies
+    def sort(self):
+        """Sorts the rows by Cue name. Only needed after changing names through self.utf directly, so the indexes
+        are built again on the next lookup."""
+        self.utf.rows.sort(key=name_key)
+        self.__invalidate_indexes()
+        self.notify("reset")
 
     def get_by_name(self, cue_name: str):
         index = self.__search_name(cue_name)
@@ -1,24 +1,28 @@
+import struct
 from collections import OrderedDict
 from io import BytesIO
-from typing import List
-
-from construct import GreedyRange, Int16sb
+from typing import List, Tuple
 
 from atom_types.runtime import util
 from atom_types.file.utf_file import ValueTypeNibble
-from atom_types.runtime.table.table_base import TableBase
+from atom_types.runtime.table.table_base import TableBase, modifies
 from atom_types.runtime.utf import UtfBlob, UtfRowCell
 
 
 def build_track_index_blob(track_indices: List[int]):
-    b = GreedyRange(Int16sb).build(track_indices)
+    # big endian int16 per track
+    b = struct.pack(f">{len(track_indices)}h", *track_indices)
     return UtfBlob("TrackIndex", BytesIO(b), 0, len(b))
 
 
 class SequenceTable(TableBase):
-    def __create_row(self, num_tracks: int, track_indices: List[int], command_index: int):
+    def __has_num_tracks(self):
         # 3.10 has NumTracks as a constant (2), so we have to check to make sure it exists
-        has_num_tracks = True if len(self.utf.rows) < 1 else "NumTracks" in self.utf.rows[0]
+        return True if len(self.utf.rows) < 1 else "NumTracks" in self.utf.rows[0]
+
+    def __create_row(self, num_tracks: int, track_indices: List[int], command_index: int, has_num_tracks=None):
+        if has_num_tracks is None:
+            has_num_tracks = self.__has_num_tracks()
         num_tracks_row = UtfRowCell.build_tuple("NumTracks", util.i16swap(num_tracks), ValueTypeNibble.int16)
 
         return OrderedDict(
@@ -28,6 +32,9 @@ class SequenceTable(TableBase):
             ])
 
     def build_stream(self, stream):
+        if not self.utf.loaded:
+            # untouched lazily parsed table, written back as-is
+            return super().build_stream(stream)
         for i in range(len(self.utf.rows)):
             # ControlWorkArea1/2 denotes index, i.e. <SequenceId>
             index_be = util.i16swap(i)
@@ -36,6 +43,7 @@ class SequenceTable(TableBase):
 
         super().build_stream(stream)
 
+    @modifies
     def update(self, index: int, num_tracks: int, track_indices: List[int], command_index: int = 1):
         try:
             has_num_tracks = True if len(self.utf.rows) < 1 else "NumTracks" in self.utf.rows[0]
@@ -43,16 +51,33 @@ class SequenceTable(TableBase):
                 self.utf.rows[index]["NumTracks"].value = util.i16swap(num_tracks)
             self.utf.rows[index]["TrackIndex"].value = build_track_index_blob(track_indices)
             self.utf.rows[index]["CommandIndex"].value = util.i16swap(command_index)
+            self.notify("updated", index)
             return index
         except KeyError:
             raise KeyError(f"Row '{index}' does not exist in Sequence list.")
 
+    @modifies
     def add(self, num_tracks: int, track_indices: List[int], command_index: int = 1):
         self.utf.rows.append(self.__create_row(num_tracks, track_indices, command_index))
+        self.notify("appended", len(self.utf.rows) - 1)
         return len(self.utf.rows) - 1
 
+    @modifies
+    def add_many(self, sequences: List[Tuple[int, List[int], int]]) -> range:
+        """Appends one row per (num_tracks, track_indices, command_index) and returns the new row indices."""
+        start = len(self.utf.rows)
+        has_num_tracks = self.__has_num_tracks()
+        self.utf.rows.extend([self.__create_row(num_tracks, track_indices, command_index, has_num_tracks)
+                              for num_tracks, track_indices, command_index in sequences])
+        self.notify("appended", start)
+        return range(start, len(self.utf.rows))
+
+    @modifies
     def insert(self, index: int, num_tracks: int, track_indices: List[int], command_index: int = 1):
         self.utf.rows.insert(index, self.__create_row(num_tracks, track_indices, command_index))
+        self.notify("inserted", index)
 
+    @modifies
     def pop(self, index: int):
         self.utf.rows.pop(index)
+        self.notify("removed", index)
@@ -1,48 +1,178 @@
 import logging
+import os
+import time
+import weakref
 from collections import OrderedDict
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 import hashlib
 from io import BytesIO
-from typing import Union
+from typing import List, NamedTuple, Union
 from construct import Lazy
 
 from atom_types.file.utf_file import ValueTypeNibble
-from atom_types.runtime.table.table_base import TableBase
+from atom_types.runtime.table.table_base import TableBase, modifies
 from atom_types.runtime.awb import Awb
+from atom_types.runtime.file_pool import FilePool
+from atom_types.runtime.hash_cache import HashCache, user_cache_dir
 from atom_types.runtime.utf import Utf, UtfBlob, UtfRowCell
 from pathlib import Path
 
 
+class AwbCommit(NamedTuple):
+    """What was captured while writing an AWB."""
+    path: str
+    md5: bytes
+    header: bytes
+
+
 class StreamAwbTable(TableBase):
+    # streaming AWBs kept open to read entries from, and parsed AWBs kept in memory. AWBs that were changed are
+    # always kept, and AWBs that are still used somewhere are handed out again instead of being parsed again
+    maxOpenFiles = 8
+    maxLoadedAwbs = 16
+    # threads used by load_all_awbs, None lets ThreadPoolExecutor decide
+    loadWorkers = None
+    # file in the user's cache directory (not the game's) that AWB hashes are kept in between runs, None to always
+    # hash
+    hashCacheName = "awb_hashes.json"
+    # threads that build_stream builds and hashes AWBs on, and the size of the reads used to hash
+    hashWorkers = 4
+    hashBufferSize = 4 * 1024 * 1024
+
     @dataclass
     class AwbInfo:
         name: str
-        awb: Awb
+        table: "StreamAwbTable" = field(repr=False, compare=False)
+        # the AWB changed since it was last written, so it has to be built and its hash and header updated. Set
+        # through awb_changed whenever the parsed Awb changes
         modified: bool = False
         needsHash: bool = False
 
+        @property
+        def awb(self) -> Awb:
+            """Opened and parsed on first access."""
+            return self.table.load_awb(self.name)
+
+        @property
+        def loaded(self) -> bool:
+            return self.name in self.table.liveAwbs
+
     def get_awb_path(self, name, rebuild=False):
         if rebuild:
             return (Path(self.awbDirectory) / "rebuild" / name).with_suffix(".awb")
         else:
             return (Path(self.awbDirectory) / name).with_suffix(".awb")
 
-    def parse_awb(self, name):
+    def parse_awb(self, name) -> Awb:
         awbPath = self.get_awb_path(name)
-        awb = Awb.parse_file(awbPath)
-        self.awbList.append(self.AwbInfo(name, awb))
+        awb = Awb.parse_file(awbPath, self.useMmap, self.pool)
+        awb.listeners.append(self)
+        return awb
+
+    def awb_changed(self, awb: Awb):
+        """Marks the AWB for building. AWBs that were unloaded while still in use somewhere are loaded again, so the
+        changes are kept after that reference is gone."""
+        for name, liveAwb in self.liveAwbs.items():
+            if liveAwb is awb:
+                self.loadedAwbs[name] = awb
+                self.loadedAwbs.move_to_end(name)
+                self.awbList[self.awbListIndexByName[name]].modified = True
+                # its hash changes once it's built
+                self.dirty = True
+                return
+
+    def add_awb_info(self, name):
+        self.awbList.append(self.AwbInfo(name, self))
         self.awbListIndexByName[name] = len(self.awbList) - 1
 
+    def load_awb(self, name) -> Awb:
+        try:
+            self.loadedAwbs.move_to_end(name)
+            return self.loadedAwbs[name]
+        except KeyError:
+            pass
+        awb = self.liveAwbs.get(name)
+        if awb is None:
+            awb = self.liveAwbs[name] = self.parse_awb(name)
+        self.loadedAwbs[name] = awb
+        self.log.debug(f"Loaded {name}.awb ({len(awb.tree.files)} files, {len(self.loadedAwbs)} AWBs loaded)")
+        self.unload_awbs()
+        return awb
+
+    def load_all_awbs(self, workers: int = None) -> List[Awb]:
+        """Parses every AWB that isn't loaded yet on a thread pool, since most of the time is spent waiting on
+        storage.
+
+        :param: workers: Number of threads, defaults to loadWorkers
+        :returns: Every AWB, in row order
+        """
+        workers = self.loadWorkers if workers is None else workers
+
+        def parse(name):
+            start = time.perf_counter()
+            awb = self.parse_awb(name)
+            self.log.debug(f"Parsed {name}.awb in {(time.perf_counter() - start) * 1000:.1f} ms "
+                           f"({len(awb.tree.files)} files)")
+            return name, awb
+
+        start = time.perf_counter()
+        awbs = dict(self.liveAwbs)
+        names = [info.name for info in self.awbList if info.name not in awbs]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for name, awb in executor.map(parse, names):
+                awbs[name] = self.liveAwbs[name] = awb
+        for info in self.awbList:
+            self.loadedAwbs[info.name] = awbs[info.name]
+        self.log.debug(f"Parsed {len(names)} AWBs in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        self.unload_awbs()
+        return [awbs[info.name] for info in self.awbList]
+
+    def unload_awbs(self, keep: int = None):
+        """Drops the least recently used parsed AWBs until at most keep (default maxLoadedAwbs) unchanged AWBs
+        are left. Changed AWBs are always kept, they only exist in memory. Dropped AWBs that are still used
+        somewhere (like the list returned by load_all_awbs) stay in liveAwbs, so changes made through them later
+        aren't lost."""
+        keep = self.maxLoadedAwbs if keep is None else keep
+        unchanged = [name for name, awb in self.loadedAwbs.items()
+                     if not (awb.modified or self.awbList[self.awbListIndexByName[name]].modified)]
+        for name in unchanged[:max(0, len(unchanged) - keep)]:
+            del self.loadedAwbs[name]
+            self.log.debug(f"Unloaded {name}.awb")
+
+    def close(self):
+        """Closes the AWB files kept open for reading and the mapped ones."""
+        self.pool.close()
+        for awb in list(self.liveAwbs.values()):
+            awb.close()
+
     def build_awb(self, awb: Awb, name):
         awbPath = self.get_awb_path(name, True)
-        awb.build_file(awbPath)
-        return self.hash_awb(awbPath)
+        awbPath.parent.mkdir(exist_ok=True)
+        return self.build_awb_file(awb, awbPath).md5
+
+    def build_awb_file(self, awb: Awb, awbPath) -> AwbCommit:
+        """Writes the AWB in one pass, capturing its header and MD5 on the way."""
+        md5 = hashlib.md5()
+        header = awb.build_file(awbPath, md5)
+        if self.hashCache is not None:
+            self.hashCache.put(awbPath, md5.digest())
+        return AwbCommit(str(awbPath), md5.digest(), header)
 
     def hash_awb(self, awbPath: str):
-        with open(awbPath, "rb") as f:
-            md5 = hashlib.md5()
-            for chunk in iter(lambda: f.read(4096), b""):
-                md5.update(chunk)
+        if self.hashCache is not None:
+            digest = self.hashCache.get(awbPath)
+            if digest is not None:
+                return digest
+        md5 = hashlib.md5()
+        buffer = memoryview(bytearray(self.hashBufferSize))
+        # md5 releases the GIL on updates this large, so several AWBs can be hashed at once
+        with open(awbPath, "rb", buffering=0) as f:
+            for n in iter(lambda: f.readinto(buffer), 0):
+                md5.update(buffer[:n])
+        if self.hashCache is not None:
+            self.hashCache.put(awbPath, md5.digest())
         return md5.digest()
 
     # Calculate the global waveform ID by adding the file counts of preceding AWBs
@@ -53,26 +183,55 @@ class StreamAwbTable(TableBase):
         streamAwbId += awbWaveformIndex
         return streamAwbId
 
-    def __init__(self, utf: Utf, awbDirectory: str):
-        self.utf = utf
+    def __init__(self, utf: Utf, awbDirectory: str, useMmap: bool = False):
+        super().__init__(utf)
         self.awbDirectory = awbDirectory
+        self.useMmap = useMmap
         self.awbList = []
         self.awbListIndexByName = {}
+        # parsed AWBs by name, least recently used first
+        self.loadedAwbs = OrderedDict()
+        # every parsed AWB that is still referenced, by loadedAwbs or by whoever it was handed out to
+        self.liveAwbs = weakref.WeakValueDictionary()
+        self.pool = FilePool(self.maxOpenFiles)
+        self.hashCache = HashCache(user_cache_dir() / self.hashCacheName) if self.hashCacheName else None
         self.log = logging.getLogger("stream_awb")
 
+        # AWBs are only opened once they're used
         for row in self.utf.rows:
-            self.parse_awb(row["Name"].value)
+            self.add_awb_info(row["Name"].value)
 
     def build_stream(self, stream):
-        for i, row in enumerate(self.utf.rows):
-            if self.awbList[i].modified:
-                self.log.debug(f'Building modified awb for {row["Name"].value}')
-                awb = self.build_awb(self.awbList[i].awb, row["Name"].value)
-                row["Hash"] = UtfBlob("Hash", BytesIO(awb), 0, 16)
-            elif self.awbList[i].needsHash:
-                self.log.debug(f'Hashing {row["Name"].value}')
-                hash = self.hash_awb(self.get_awb_path(row["Name"].value))
-                row["Hash"].value = UtfBlob("Hash", BytesIO(hash), 0, 16)
+        # parsed here, since loading isn't thread safe
+        pending = [(i, info.awb if info.modified else None) for i, info in enumerate(self.awbList)
+                   if info.modified or info.needsHash]
+
+        def process(job):
+            i, awb = job
+            name = self.awbList[i].name
+            start = time.perf_counter()
+            if awb is not None:
+                self.log.debug(f'Building modified awb for {name}')
+                digest = self.build_awb(awb, name)
+            else:
+                self.log.debug(f'Hashing {name}')
+                digest = self.hash_awb(self.get_awb_path(name))
+            self.log.debug(f"Got hash of {name} in {(time.perf_counter() - start) * 1000:.1f} ms")
+            return digest
+
+        if pending:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.hashWorkers) as executor:
+                digests = list(executor.map(process, pending))
+            for (i, _), digest in zip(pending, digests):
+                self.utf.rows[i]["Hash"].value = UtfBlob("Hash", BytesIO(digest), 0, 16)
+                self.awbList[i].modified = False
+                self.awbList[i].needsHash = False
+            self.log.debug(f"Hashed {len(pending)} AWBs in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        if self.hashCache is not None:
+            self.log.debug(f"Hash cache: {self.hashCache.hits} hits, {self.hashCache.misses} misses")
+            self.hashCache.save()
         super().build_stream(stream)
 
     @classmethod
@@ -83,19 +242,20 @@ class StreamAwbTable(TableBase):
     def parse(cls, awbDirectory, data):
         return cls(Utf.parse(data), awbDirectory)
 
+    @modifies
     def update_awb(self, index: int, name: str):
         try:
             self.utf.rows[index]["Name"] = name
         except KeyError:
             raise KeyError(f"Row '{index}' does not exist in Stream AWB list.")
 
+    @modifies
     def add_awb_by_name(self, name: str):
         """Unused function. Adding a new AWB doesn't work, so this was ignored during refactoring."""
         if name in [row["Name"] for row in self.utf.rows]:
             raise KeyError(f"AWB named '{name}' already exists in Stream AWB list.")
 
-        # parse_awb will add to awbList
-        self.parse_awb(name)
+        self.add_awb_info(name)
         # mark for rehash later so our row gets the correct hash
         self.awbList[-1].needsHash = True
 
@@ -107,18 +267,41 @@ class StreamAwbTable(TableBase):
         self.utf.rows.append(row)
         return len(self.utf.rows) - 1
 
+    @modifies
     def mark_awb_for_rehash(self, index: int):
         self.awbList[index].needsHash = True
 
+    @modifies
+    def write_awb(self, index: int, awbPath) -> AwbCommit:
+        """Writes the AWB to awbPath (which will replace the original) and stores its hash, computed while
+        writing, in its row. The parsed AWB reads its entries from awbPath afterwards."""
+        info = self.awbList[index]
+        awb = info.awb
+        self.log.debug(f"Writing {info.name}.awb to '{awbPath}'")
+        commit = self.build_awb_file(awb, awbPath)
+        self.utf.rows[index]["Hash"].value = UtfBlob("Hash", BytesIO(commit.md5), 0, 16)
+        info.needsHash = False
+        # the ACB matches the written file now
+        info.modified = False
+        if os.path.samefile(awbPath, self.get_awb_path(info.name)):
+            # written over its own file, so it's unchanged again. Otherwise it's kept in memory until the original
+            # is replaced
+            awb.modified = False
+        return commit
+
+    @modifies
     def pop_awb_by_name(self, name: str):
         try:
             index = self.awbListIndexByName[name]
             self.awbList.pop(index)
             self.awbListIndexByName.pop(name)
+            self.loadedAwbs.pop(name, None)
+            self.liveAwbs.pop(name, None)
             self.utf.rows.pop(index)
         except KeyError:
             raise KeyError(f"AWB named '{name}' does not exist in Stream AWB list.")
 
+    @modifies
     def pop_awb_by_index(self, index: int):
         try:
             self.awbList.pop(index)
@@ -139,6 +322,7 @@ class StreamAwbTable(TableBase):
         except KeyError:
             raise KeyError(f"Row index '{index}' does not exist in Stream AWB list.")
 
+    @modifies
     def update_waveform(self, awbName: str, waveformIndex: int, waveformData: Union[Lazy, bytes]):
         try:
             index = next(filter(lambda x: x[1]["Name"] == awbName, enumerate(self.utf.rows)))[0]
@@ -149,6 +333,7 @@ class StreamAwbTable(TableBase):
         except StopIteration:
             raise KeyError(f"AWB named '{awbName}' does not exist in Stream AWB list.")
 
+    @modifies
     def append_waveform(self, awbName: str, waveformData: Union[Lazy, bytes]):
         try:
             index = next(filter(lambda x: x[1]["Name"] == awbName, enumerate(self.utf.rows)))[0]
@@ -156,6 +341,7 @@ class StreamAwbTable(TableBase):
         except StopIteration:
             raise KeyError(f"AWB named '{awbName}' does not exist in Stream AWB list.")
 
+    @modifies
     def insert_waveform(self, awbName: str, waveformIndex: int, waveformData: Union[Lazy, bytes]):
         try:
             index = next(filter(lambda x: x[1]["Name"] == awbName, enumerate(self.utf.rows)))[0]
@@ -163,6 +349,7 @@ class StreamAwbTable(TableBase):
         except StopIteration:
             raise KeyError(f"AWB named '{awbName}' does not exist in Stream AWB list.")
 
+    @modifies
     def pop_waveform(self, awbName: str, waveformIndex: int):
         try:
             index = next(filter(lambda x: x[1]["Name"] == awbName, enumerate(self.utf.rows)))[0]
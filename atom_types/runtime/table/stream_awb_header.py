@@ -1,11 +1,12 @@
 from collections import OrderedDict
 
 from atom_types.file.utf_file import ValueTypeNibble
-from atom_types.runtime.table.table_base import TableBase
+from atom_types.runtime.table.table_base import TableBase, modifies
 from atom_types.runtime.utf import UtfRowCell
 
 
 class StreamAwbAfs2Header(TableBase):
+    @modifies
     def update(self, awbPortId: int, newHeader):
         size = len(self.utf.rows)
         if size > awbPortId:
@@ -1,16 +1,20 @@
+import struct
 from collections import OrderedDict
 from io import BytesIO
-
-from construct import Array, Int16ub
+from typing import List
 
 from atom_types.file.utf_file import ValueTypeNibble
 from atom_types.runtime import util
-from atom_types.runtime.table.table_base import TableBase
+from atom_types.runtime.table.table_base import TableBase, modifies
 from atom_types.runtime.utf import UtfBlob, UtfRowCell
 
 
+# item type (1 is a waveform) and index
+ReferenceItems = struct.Struct(">HH")
+
+
 def create_reference_items_blob(waveform_index: int):
-    data = Array(2, Int16ub).build((1, waveform_index))
+    data = ReferenceItems.pack(1, waveform_index)
     return UtfBlob("ReferenceItems", BytesIO(data), 0, len(data))
 
 
@@ -24,6 +28,9 @@ def create_row(waveform_index: int):
 class SynthTable(TableBase):
 
     def build_stream(self, stream):
+        if not self.utf.loaded:
+            # untouched lazily parsed table, written back as-is
+            return super().build_stream(stream)
         for i, row in enumerate(self.utf.rows):
             # ControlWorkArea1/2 denotes index, i.e. <SynthId>
             index_be = util.i16swap(i)
@@ -31,18 +38,34 @@ class SynthTable(TableBase):
             self.utf.rows[i]["ControlWorkArea2"] = UtfRowCell.build("ControlWorkArea2", index_be, ValueTypeNibble.int16)
         super().build_stream(stream)
 
+    @modifies
     def update(self, index: int, waveform_index: int):
         try:
-            self.utf.rows[index]["ReferenceItems"] = create_reference_items_blob(waveform_index)
+            self.utf.rows[index]["ReferenceItems"].value = create_reference_items_blob(waveform_index)
+            self.notify("updated", index)
         except KeyError:
             raise KeyError(f"Synth ID '{index}' does not exist in Synth list.")
 
+    @modifies
     def add(self, waveform_index: int) -> int:
         self.utf.rows.append(create_row(waveform_index))
+        self.notify("appended", len(self.utf.rows) - 1)
         return len(self.utf.rows) - 1
 
+    @modifies
+    def add_many(self, waveform_indices: List[int]) -> range:
+        """Appends one row per waveform index and returns the new row indices."""
+        start = len(self.utf.rows)
+        self.utf.rows.extend([create_row(waveform_index) for waveform_index in waveform_indices])
+        self.notify("appended", start)
+        return range(start, len(self.utf.rows))
+
+    @modifies
     def insert(self, index: int, waveform_index: int):
         self.utf.rows.insert(index, create_row(waveform_index))
+        self.notify("inserted", index)
 
+    @modifies
     def pop(self, index: int):
         self.utf.rows.pop(index)
+        self.notify("removed", index)
@@ -1,9 +1,42 @@
+import functools
 import io
 from atom_types.runtime.utf import Utf
 
+
+def modifies(func):
+    """Marks the table as dirty once the decorated method is done, even if it raises, since it may have changed
+    rows before raising."""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self.dirty = True
+    return wrapper
+
+
 class TableBase:
     def __init__(self, utf):
         self.utf = utf
+        # untouched tables are written back into the ACB as they were parsed
+        self.dirty = False
+        # objects with a table_changed(table, event, index) method, like ReferenceGraph
+        self.listeners = []
+
+    def mark_dirty(self):
+        """Call after changing self.utf directly instead of through the table's methods."""
+        self.dirty = True
+        self.notify("reset")
+
+    def notify(self, event: str, index: int = 0):
+        """Tells listeners which rows changed.
+
+        :param: event: "appended" (every row from index on is new), "inserted", "removed", "updated" or
+            "reset" (anything could have changed)
+        :param: index: Row index
+        """
+        for listener in self.listeners:
+            listener.table_changed(self, event, index)
     
     @classmethod
     def parse_stream(cls, stream, pos=None):
@@ -1,9 +1,9 @@
 from collections import OrderedDict
-from typing import Literal
+from typing import List, Literal, Tuple
 
 from atom_types.file.utf_file import ValueTypeNibble
 from atom_types.runtime import util
-from atom_types.runtime.table.table_base import TableBase
+from atom_types.runtime.table.table_base import TableBase, modifies
 from atom_types.runtime.utf import UtfRowCell
 
 
@@ -11,8 +11,12 @@ def get_channel_id(channel: Literal["speaker", "headphone"]):
     return 0 if channel == "speaker" else 1
 
 class TrackTable(TableBase):
-    def __create_row(self, track_event_id: int, channel: Literal["speaker", "headphone"]):
-        has_event_index = True if len(self.utf.rows) < 1 else "EventIndex" in self.utf.rows[0]
+    def __has_event_index(self):
+        return True if len(self.utf.rows) < 1 else "EventIndex" in self.utf.rows[0]
+
+    def __create_row(self, track_event_id: int, channel: Literal["speaker", "headphone"], has_event_index=None):
+        if has_event_index is None:
+            has_event_index = self.__has_event_index()
         event_index_row = UtfRowCell.build_tuple("EventIndex", util.i16swap(track_event_id), ValueTypeNibble.int16)
 
         return OrderedDict(
@@ -20,23 +24,38 @@ class TrackTable(TableBase):
                 UtfRowCell.build_tuple("CommandIndex", util.i16swap(get_channel_id(channel)), ValueTypeNibble.int16),
             ])
 
+    @modifies
     def add(self, track_event_id: int, channel: Literal["speaker", "headphone"]):
         # bruh
         self.utf.rows.append(self.__create_row(track_event_id, channel))
+        self.notify("appended", len(self.utf.rows) - 1)
         return len(self.utf.rows) - 1
     
+    @modifies
+    def add_many(self, tracks: List[Tuple[int, Literal["speaker", "headphone"]]]) -> range:
+        """Appends one row per (track_event_id, channel) and returns the new row indices."""
+        start = len(self.utf.rows)
+        has_event_index = self.__has_event_index()
+        self.utf.rows.extend([self.__create_row(track_event_id, channel, has_event_index)
+                              for track_event_id, channel in tracks])
+        self.notify("appended", start)
+        return range(start, len(self.utf.rows))
+
+    @modifies
     def update(self, index: int, channel: Literal["speaker", "headphone"]):
         try:
             self.utf.rows[index]["CommandIndex"].value = util.i16swap(get_channel_id(channel))
+            self.notify("updated", index)
         except KeyError:
             raise KeyError(f"Row '{index}' does not exist in Track list.")
 
+    @modifies
     def insert(self, index: int, channel: Literal["speaker", "headphone"]):
-        rowData = {
-            "EventIndex": len(self.utf.rows) - 1,
-            "CommandIndex": 0 if channel == "speaker" else 1
-        }
-        self.utf.rows.insert(index, rowData)
+        # EventIndex is the index of the current last row, as it always was
+        self.utf.rows.insert(index, self.__create_row(len(self.utf.rows) - 1, channel))
+        self.notify("inserted", index)
         
+    @modifies
     def pop(self, index: int):
-        self.utf.rows.pop(index)
\ No newline at end of file
+        self.utf.rows.pop(index)
+        self.notify("removed", index)
\ No newline at end of file
@@ -1,32 +1,39 @@
+import struct
 from collections import OrderedDict
 from io import BytesIO
-
-from construct import Byte, Default, FocusedSeq
-from construct.core import Int16sb
+from typing import List
 
 from atom_types.file.utf_file import ValueTypeNibble
-from atom_types.runtime.table.table_base import TableBase
+from atom_types.runtime.table.table_base import TableBase, modifies
 from atom_types.runtime.utf import UtfBlob, UtfRowCell
 
 
 class TrackEventTable(TableBase):
-    TrackEventCommand = FocusedSeq("synthIndex",
-                                   "tlv_code" / Default(Int16sb, 2000),
-                                   "tlv_size" / Default(Byte, 4),
-                                   "tlv_type" / Default(Int16sb, 2),
-                                   "synthIndex" / Int16sb,
-                                   "unk1" / Default(Byte, 0),
-                                   "unk2" / Default(Int16sb, 0)
-                                   )
+    # note on (tlv_code 2000, tlv_size 4) of a synth (tlv_type 2), then two unknown fields that are always 0
+    TrackEventCommand = struct.Struct(">hBhhBh")
 
-    def add(self, synth_id: int):
-        command = self.TrackEventCommand.build(synth_id)
+    def __create_row(self, synth_id: int):
+        command = self.TrackEventCommand.pack(2000, 4, 2, synth_id, 0, 0)
         command_blob = UtfBlob("Command", BytesIO(command), 0, len(command))
-        row = OrderedDict([
+        return OrderedDict([
             UtfRowCell.build_tuple("Command", command_blob, ValueTypeNibble.blob),
         ])
-        self.utf.rows.append(row)
+
+    @modifies
+    def add(self, synth_id: int):
+        self.utf.rows.append(self.__create_row(synth_id))
+        self.notify("appended", len(self.utf.rows) - 1)
         return len(self.utf.rows) - 1
 
+    @modifies
+    def add_many(self, synth_ids: List[int]) -> range:
+        """Appends one row per synth ID and returns the new row indices."""
+        start = len(self.utf.rows)
+        self.utf.rows.extend([self.__create_row(synth_id) for synth_id in synth_ids])
+        self.notify("appended", start)
+        return range(start, len(self.utf.rows))
+
+    @modifies
     def pop(self, index: int):
         self.utf.rows.pop(index)
+        self.notify("removed", index)
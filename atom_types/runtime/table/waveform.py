@@ -1,8 +1,9 @@
 from collections import OrderedDict
+from typing import List, Tuple
 
 from atom_types.file.utf_file import ValueTypeNibble
 from atom_types.runtime import util
-from atom_types.runtime.table.table_base import TableBase
+from atom_types.runtime.table.table_base import TableBase, modifies
 from atom_types.runtime.utf import UtfRowCell
 
 
@@ -23,10 +24,11 @@ class WaveformTable(TableBase):
     #     except StopIteration:
     #         raise KeyError(f"Row '{index}' does not exist in waveform list.")
 
-    def add(self, awbId: int, awbFileId: int, numSamples: int, numChannels: int = 2, loop: bool = True):
+    @staticmethod
+    def __create_row(awbId: int, awbFileId: int, numSamples: int, numChannels: int, loop: bool):
         # TODO: this might not work out of the box for 3.10?
         # looks like they're all LoopFlag = 1 and NumChannels = 2 at first glance
-        row = OrderedDict([
+        return OrderedDict([
             UtfRowCell.build_tuple("NumChannels", numChannels, ValueTypeNibble.int8),
             UtfRowCell.build_tuple("LoopFlag", 1 if loop else 0, ValueTypeNibble.int8),
             UtfRowCell.build_tuple("NumSamples", util.i32swap(numSamples), ValueTypeNibble.int32),
@@ -34,8 +36,23 @@ class WaveformTable(TableBase):
             UtfRowCell.build_tuple("StreamAwbPortNo", util.i16swap(awbId), ValueTypeNibble.int16),
             UtfRowCell.build_tuple("StreamAwbId", util.i16swap(awbFileId), ValueTypeNibble.int16)
         ])
-        self.utf.rows.append(row)
+
+    @modifies
+    def add(self, awbId: int, awbFileId: int, numSamples: int, numChannels: int = 2, loop: bool = True):
+        self.utf.rows.append(self.__create_row(awbId, awbFileId, numSamples, numChannels, loop))
+        self.notify("appended", len(self.utf.rows) - 1)
         return len(self.utf.rows) - 1
 
+    @modifies
+    def add_many(self, waveforms: List[Tuple[int, int, int]], numChannels: int = 2, loop: bool = True) -> range:
+        """Appends one row per (awbId, awbFileId, numSamples) and returns the new row indices."""
+        start = len(self.utf.rows)
+        self.utf.rows.extend([self.__create_row(awbId, awbFileId, numSamples, numChannels, loop)
+                              for awbId, awbFileId, numSamples in waveforms])
+        self.notify("appended", start)
+        return range(start, len(self.utf.rows))
+
+    @modifies
     def pop(self, index: int):
         self.utf.rows.pop(index)
+        self.notify("removed", index)
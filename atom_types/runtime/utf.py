@@ -1,9 +1,17 @@
 from __future__ import annotations
+import hashlib
 import io
+import logging
+import mmap
+import struct
+from dataclasses import dataclass
 from typing import OrderedDict
-from construct import Bytes, CString, Container, GreedyBytes, ListContainer, Pointer
+from construct import Bytes, CString, Container, Pointer
 
 from atom_types.runtime import util
+from atom_types.runtime.columnar import ColumnarRows
+from atom_types.runtime.row_format import COLUMN_TYPE_NIBBLES, VALUE_TYPE_NIBBLES, RowFormat, StringPool, \
+    StringPoolWriter, pack_value, value_size
 from atom_types.file.utf_file import Utf_File, UtfField, ValueTypeNibble, ColumnTypeNibble
 
 
@@ -45,6 +53,9 @@ from atom_types.file.utf_file import Utf_File, UtfField, ValueTypeNibble, Column
 #         self.pos = pos
 #         self.size = size
 
+log = logging.getLogger("utf")
+
+
 def pad_stream_to_alignment(stream, alignment):
     tell = stream.tell()
     numPadBytes = alignment - (tell % alignment)
@@ -58,20 +69,36 @@ class UtfBlob:
         self.pos = pos
         self.length = length
         self.columnName = columnName
+        # depends on the signature, which is only read once it's needed
+        self.__shouldPrepad = None
+
+    @property
+    def shouldPrepad(self) -> bool:
+        if self.__shouldPrepad is None:
+            signature = self.read(4)
+            columnName = self.columnName
+            if (b"UTF" in signature or b"AFS2" in signature or
+                    columnName == "AcfMd5Hash" or columnName == "AcbGuid" or columnName == "StreamAwbTocWork"):
+                self.__shouldPrepad = True
+                # self.postPadding = 4 - (length % 4) if length % 4 else 0
+            else:
+                self.__shouldPrepad = False
+                # self.postPadding = 0
 
-        signature = self.read(4)
-        if (b"UTF" in signature or b"AFS2" in signature or
-                columnName == "AcfMd5Hash" or columnName == "AcbGuid" or columnName == "StreamAwbTocWork"):
-            self.shouldPrepad = True
-            # self.postPadding = 4 - (length % 4) if length % 4 else 0
-        else:
-            self.shouldPrepad = False
-            # self.postPadding = 0
+            # hack
+            if columnName == "StreamAwbAfs2Header_NoPrepad":
+                self.__shouldPrepad = False
+            # print(f"signature: {signature}, columnName: {columnName}, prepad: {self.shouldPrepad}")
+        return self.__shouldPrepad
+
+    @shouldPrepad.setter
+    def shouldPrepad(self, value: bool):
+        self.__shouldPrepad = value
 
-        # hack
-        if columnName == "StreamAwbAfs2Header_NoPrepad":
-            self.shouldPrepad = False
-        # print(f"signature: {signature}, columnName: {columnName}, prepad: {self.shouldPrepad}")
+    @property
+    def mapped(self) -> bool:
+        """True if the blob lives in a memory-mapped file."""
+        return isinstance(self.stream, mmap.mmap)
 
     def read(self, length=None):
         originalPos = self.stream.tell()
@@ -80,13 +107,22 @@ class UtfBlob:
         self.stream.seek(originalPos)
         return data
 
+    def view(self) -> memoryview:
+        """Returns the blob as a memoryview, without copying if the blob is memory-mapped."""
+        if self.mapped:
+            return memoryview(self.stream)[self.pos:self.pos + self.length]
+        return memoryview(self.read())
+
     def build_stream(self, outStream):
         if self.shouldPrepad:
             # print(f"prepadding {self.columnName}")
             pad_stream_to_alignment(outStream, 32)
         pointer = outStream.tell()
-        self.stream.seek(self.pos)
-        Bytes(self.length).build_stream(self.stream.read(self.length), outStream)
+        if self.mapped:
+            outStream.write(self.view())
+        else:
+            self.stream.seek(self.pos)
+            Bytes(self.length).build_stream(self.stream.read(self.length), outStream)
         return pointer
 
     def build(self):
@@ -118,67 +154,246 @@ class UtfRowCell:
         return name, cls.build(name, value, value_type, column_type)
 
 
+@dataclass
+class UtfBuildReport:
+    name: str
+    size: int
+    stringsSize: int
+    stringBytesSaved: int = 0
+    blobBytesSaved: int = 0
+
+
 class Utf:
+    # How rows are decoded by parse_stream:
+    # "struct" unpacks the whole row region with a compiled RowFormat,
+    # "construct" parses every cell with UtfField (the original, slow path),
+    # "validate" does both and raises if they disagree.
+    row_decoder = "struct"
+    # Store rows in ColumnarRows (one typed array per column) instead of a list of OrderedDicts
+    columnar = False
+    # Only parse the header and columns, and decode rows the first time they are accessed.
+    # Tables whose rows were never accessed are written back byte-for-byte.
+    lazy = False
+    # Share a single copy of identical strings in the string area when building
+    compact_strings = False
+    # Share a single copy of blobs with identical contents when building
+    dedupe_blobs = False
+
     def __init__(self, name, columns, rows, tree: Container):
         self.name = name
         self.columns = columns
         self.rows = rows
         self.tree = tree
+        self.__rawSource = None  # (stream, position, size) of a lazily parsed table
+        self.lastBuildReport = None
+
+    @property
+    def rows(self):
+        if self.__rowLoader is not None:
+            self.__rows = self.__rowLoader()
+            self.__rowLoader = None
+        return self.__rows
+
+    @rows.setter
+    def rows(self, rows):
+        self.__rows = rows
+        self.__rowLoader = None
+
+    @property
+    def loaded(self) -> bool:
+        """False if this table was parsed lazily and its rows haven't been decoded yet."""
+        return self.__rowLoader is None
 
     @classmethod
-    def parse(cls, data):
+    def parse(cls, data, row_decoder=None, columnar=None, lazy=None):
         stream = io.BytesIO(data)
-        return cls.parse_stream(stream)
+        return cls.parse_stream(stream, row_decoder=row_decoder, columnar=columnar, lazy=lazy)
 
     @classmethod
-    def parse_stream(cls, stream, pos=None):
+    def parse_stream(cls, stream, pos=None, row_decoder=None, columnar=None, lazy=None):
         if pos:
             stream.seek(pos)
+        row_decoder = row_decoder or cls.row_decoder
+        columnar = cls.columnar if columnar is None else columnar
+        lazy = cls.lazy if lazy is None else lazy
 
         tree = Utf_File.parse_stream(stream)
+        rowsStart = stream.tell()
         runtimeColumns = OrderedDict()
-        runtimeRows = []
-
-        def make_runtime_value(columnName, valueType, field):
-            if valueType == "string" and field.string:
-                return field.string
-            elif valueType == "blob":
-                if "blobLength" in field and field.blobLength:
-                    return UtfBlob(columnName, stream, field.blobPointerAbsolute, field.blobLength)
-                else:
-                    return None
-            else:
-                return field
 
         for column in tree.columns:
             if column.types.column == "constant":
-                colValue = make_runtime_value(column.name, column.types.value, column.constant)
+                colValue = cls.__make_runtime_value(stream, column.name, column.types.value, column.constant)
             else:
                 colValue = None
             runtimeColumns[column.name] = UtfColumn(column.name, column.types, colValue)
 
+        name = Pointer(tree.header.stringsPointer, CString(encoding="utf8")).parse_stream(stream)
+        utf = cls(name, runtimeColumns, None, tree)
+
+        def load_rows():
+            originalPos = stream.tell()
+            rows = cls.__parse_rows(stream, tree, runtimeColumns, rowsStart, row_decoder, columnar)
+            stream.seek(originalPos)
+            return rows
+
+        if lazy:
+            utf.__rowLoader = load_rows
+            utf.__rawSource = (stream, tree.startPointer, tree.header.size + 8)
+        else:
+            utf.rows = load_rows()
+        stream.seek(rowsStart + tree.header.rowSize * tree.header.rowCount)
+        return utf
+
+    @staticmethod
+    def __make_runtime_value(stream, columnName, valueType, field):
+        if valueType == "string" and field.string:
+            return field.string
+        elif valueType == "blob":
+            if "blobLength" in field and field.blobLength:
+                return UtfBlob(columnName, stream, field.blobPointerAbsolute, field.blobLength)
+            else:
+                return None
+        else:
+            return field
+
+    @classmethod
+    def __parse_rows(cls, stream, tree, runtimeColumns, rowsStart, row_decoder, columnar):
+        runtimeRows = []
+        variableColumns = [column for column in runtimeColumns.values() if column.types.column == "variable"]
+        if columnar:
+            runtimeRows = ColumnarRows(variableColumns, stream, UtfBlob)
         if tree.header.rowSize > 0 and tree.header.rowCount > 0:
-            for i in range(tree.header.rowCount):
-                runtimeRows.append(OrderedDict())
-                for column in runtimeColumns.values():
-                    if column.types.column == "variable":
-                        field = UtfField(column.types.value, tree.header).parse_stream(stream)
-                        rowValue = make_runtime_value(column.name, column.types.value, field)
+            parsedRows = None
+            if row_decoder != "construct":
+                if columnar:
+                    parsedRows = cls.__parse_rows_columnar(stream, tree, variableColumns, runtimeRows)
+                else:
+                    parsedRows = cls.__parse_rows_struct(stream, tree, variableColumns)
+            if parsedRows is None or row_decoder == "validate":
+                stream.seek(rowsStart)
+                constructRows = cls.__parse_rows_construct(stream, tree, variableColumns)
+                if parsedRows is not None:
+                    cls.__validate_rows(tree, parsedRows, constructRows)
+                elif columnar:
+                    for row in constructRows:
+                        runtimeRows.append(row)
+                if not columnar:
+                    parsedRows = constructRows
+            if not columnar:
+                runtimeRows = parsedRows
+        return runtimeRows
 
-                        # these are big-endian :(
-                        if column.name in ["ControlWorkArea1", "ControlWorkArea2"]:
-                            bigEndianValue = util.i16swap(rowValue)
-                            # print(f"{column.name}: {rowValue} -> {bigEndianValue}")
-                            rowValue = bigEndianValue
+    @classmethod
+    def __parse_rows_construct(cls, stream, tree, variableColumns):
+        runtimeRows = []
+        for i in range(tree.header.rowCount):
+            runtimeRows.append(OrderedDict())
+            for column in variableColumns:
+                field = UtfField(column.types.value, tree.header).parse_stream(stream)
+                rowValue = cls.__make_runtime_value(stream, column.name, column.types.value, field)
+
+                # these are big-endian :(
+                if column.name in ["ControlWorkArea1", "ControlWorkArea2"]:
+                    bigEndianValue = util.i16swap(rowValue)
+                    # print(f"{column.name}: {rowValue} -> {bigEndianValue}")
+                    rowValue = bigEndianValue
+
+                runtimeRows[i][column.name] = UtfRowCell(column, rowValue)
+        return runtimeRows
+
+    @staticmethod
+    def __read_row_region(stream, tree, variableColumns):
+        """Reads the rows and strings of a table for decoding with a compiled RowFormat.
+        Returns None if the row format doesn't match the header, so the caller can fall back to construct."""
+        rowFormat = RowFormat(variableColumns)
+        header = tree.header
+        if rowFormat.size != header.rowSize:
+            return None
+
+        stream.seek(header.rowsPointer)
+        rowData = stream.read(header.rowSize * header.rowCount)
+        if len(rowData) != header.rowSize * header.rowCount:
+            return None
+
+        # the string area sits between the rows and the blobs
+        stringsEnd = header.blobsPointer if header.blobsPointer > header.stringsPointer \
+            else tree.startPointer + 8 + header.size
+        stream.seek(header.stringsPointer)
+        strings = StringPool(stream.read(stringsEnd - header.stringsPointer))
+        return rowFormat, rowData, strings
 
-                        runtimeRows[i][column.name] = UtfRowCell(column, rowValue)
+    @classmethod
+    def __parse_rows_struct(cls, stream, tree, variableColumns):
+        """Decodes all rows in one go with a compiled RowFormat."""
+        region = cls.__read_row_region(stream, tree, variableColumns)
+        if region is None:
+            return None
+        rowFormat, rowData, strings = region
+        blobsPointer = tree.header.blobsPointer
 
-        name = Pointer(tree.header.stringsPointer, CString(encoding="utf8")).parse_stream(stream)
-        return cls(name, runtimeColumns, runtimeRows, tree)
+        runtimeRows = []
+        for values in rowFormat.iter_unpack(rowData):
+            row = OrderedDict()
+            for column, value in zip(variableColumns, values):
+                valueType = column.types.value
+                if valueType == "string":
+                    value = strings.get(value) or ""
+                elif valueType == "blob":
+                    pointer, length = value
+                    value = UtfBlob(column.name, stream, pointer + blobsPointer, length) if length else None
+                row[column.name] = UtfRowCell(column, value)
+            runtimeRows.append(row)
+        return runtimeRows
+
+    @classmethod
+    def __parse_rows_columnar(cls, stream, tree, variableColumns, runtimeRows: ColumnarRows):
+        """Decodes all rows with a compiled RowFormat straight into the column arrays of runtimeRows."""
+        region = cls.__read_row_region(stream, tree, variableColumns)
+        if region is None:
+            return None
+        rowFormat, rowData, strings = region
+        blobsPointer = tree.header.blobsPointer
+
+        columnValues = zip(*rowFormat.iter_unpack(rowData))
+        for column, values in zip(variableColumns, columnValues):
+            valueType = column.types.value
+            if valueType == "string":
+                values = [strings.get(pointer) or "" for pointer in values]
+            elif valueType == "blob":
+                values = [(pointer + blobsPointer, length) for pointer, length in values]
+            runtimeRows.extend_column(column.name, values)
+        runtimeRows.length = tree.header.rowCount
+        return runtimeRows
+
+    @staticmethod
+    def __validate_rows(tree, structRows, constructRows):
+        def normalize(value):
+            if isinstance(value, UtfBlob):
+                return "blob", value.pos, value.length
+            elif isinstance(value, Container):
+                # empty strings come out of construct as the raw field
+                return value.string or ""
+            return value
+
+        if len(structRows) != len(constructRows):
+            raise ValueError(f"Row decoders disagree on the row count of table '{tree.header.name}'.")
+        for i, (structRow, constructRow) in enumerate(zip(structRows, constructRows)):
+            for name, cell in constructRow.items():
+                expected = normalize(cell.value)
+                actual = normalize(structRow[name].value)
+                if expected != actual and not (expected != expected and actual != actual):  # NaN
+                    raise ValueError(
+                        f"Row decoders disagree on row {i}, column '{name}' of table '{tree.header.name}': "
+                        f"{actual!r} != {expected!r}")
 
     @classmethod
-    def parse_file(cls, filename):
+    def parse_file(cls, filename, use_mmap=False):
+        """:param: use_mmap: Map the file into memory and parse from the mapping. Blobs then stay valid after
+        parsing and can be read with UtfBlob.view() without copying."""
         with open(filename, 'rb') as f:
+            if use_mmap:
+                return cls.parse_stream(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
             return cls.parse_stream(f)
 
     def build(self):
@@ -186,43 +401,27 @@ class Utf:
         self.build_stream(stream)
         return stream
 
-    def build_stream(self, stream):
-        stringsIo = io.BytesIO()
-        stringToPointer = OrderedDict()
+    def build_stream(self, stream, compact_strings=None, dedupe_blobs=None):
+        """:param: compact_strings: Share identical strings (defaults to Utf.compact_strings)
+        :param: dedupe_blobs: Share blobs with identical contents (defaults to Utf.dedupe_blobs)"""
+        if not self.loaded and self.__rawSource is not None:
+            # nothing could have changed, so copy the table as it was parsed
+            source, pos, size = self.__rawSource
+            originalPos = source.tell()
+            source.seek(pos)
+            stream.write(source.read(size))
+            source.seek(originalPos)
+            self.lastBuildReport = None
+            return
+
+        strings = StringPoolWriter(self.compact_strings if compact_strings is None else compact_strings)
         variableColumns = tuple([column for column in self.columns.values() if column.types.column == "variable"])
-        blobValues = []  # (runtimeBlob, treeBlob)
-
-        def get_string_pointer(string: str):
-            try:
-                return stringToPointer[string]
-            except KeyError:
-                pointer = stringsIo.tell()
-                CString(encoding="utf8").build_stream(string, stringsIo)
-                return pointer
-
-        def make_tree_value(type, value, blobPointer=0, blobLength=0):
-            if type == "string":
-                if "string" in value:
-                    value = value.string
-                if not value:
-                    value = ""
-                return {'stringPointer': get_string_pointer(value)}
-            elif type == "blob":
-                return {'blobPointer': blobPointer, 'blobLength': blobLength}
-            else:
-                return value
-
-        def build_utf_field(valueType, obj):
-            UtfField(valueType, self.tree.header).build_stream(obj, stream)
-
-        def build_pointer_laden_area():
-            file = Utf_File.build_stream(self.tree, stream)
+        blobValues = []  # runtime blobs in the order they are laid out: constants first, then rows
 
-            if variableColumns:
-                self.tree.rowsPointer = stream.tell()
-                for i in range(len(self.rows)):
-                    for column in variableColumns:
-                        build_utf_field(column.types.value, self.tree.rows[i][column.name])
+        def string_value(value):
+            if not isinstance(value, str) and value is not None:
+                value = value.string  # empty strings parsed by construct are the raw field
+            return value or ""
 
         # Propagate column deletion
         for i, name in [(i, column.name) for (i, column) in enumerate(self.tree.columns)]:
@@ -244,69 +443,144 @@ class Utf:
             for name in self.columns
         }
 
-        # First-pass update of data in tree
-        get_string_pointer(self.name)
+        # Strings are laid out in the order they are added: table name, column names and constants, then rows
+        strings.add(self.name)
+        constantBlobColumns = []
         for name, column in self.columns.items():
             treeColumn = nameToTreeColumnMapping[name]
-            treeColumn.namePointer = get_string_pointer(name)
+            treeColumn.namePointer = strings.add(name)
             treeColumn.types = column.types
             if column.types.column == "constant":
-                treeColumn.constant = make_tree_value(column.types.value, column.constant)
-                if column.types.value == "blob":
-                    blobValues.append((column.constant, treeColumn.constant))
-
-        self.tree.rows = ListContainer()  # Wipe rows in tree
-        if variableColumns:
-            for i, row in enumerate(self.rows):
-                treeRow = Container()
-                for column in variableColumns:
-                    treeRow[column.name] = make_tree_value(column.types.value, row[column.name].value)
-                    if column.types.value == "blob":
-                        blobValues.append((row[column.name].value, treeRow[column.name]))
-                self.tree.rows.append(treeRow)
-
-        # Write out first pass
+                if column.types.value == "string":
+                    treeColumn.constant = {'stringPointer': strings.add(string_value(column.constant))}
+                elif column.types.value == "blob":
+                    treeColumn.constant = {'blobPointer': 0, 'blobLength': 0}
+                    blobValues.append(column.constant)
+                    constantBlobColumns.append(treeColumn)
+                else:
+                    treeColumn.constant = column.constant
+
+        rowCount = len(self.rows) if variableColumns else 0
+        columnValues = [list(self.column(column.name)) for column in variableColumns] if rowCount else []
+        stringColumns = [i for i, column in enumerate(variableColumns) if column.types.value == "string"]
+        blobColumns = [i for i, column in enumerate(variableColumns) if column.types.value == "blob"]
+        if rowCount and stringColumns:
+            pointers = [[] for _ in stringColumns]
+            for values in zip(*(columnValues[i] for i in stringColumns)):
+                for columnPointers, value in zip(pointers, values):
+                    columnPointers.append(strings.add(string_value(value)))
+            for i, columnPointers in zip(stringColumns, pointers):
+                columnValues[i] = columnPointers
+        if rowCount and blobColumns:
+            for values in zip(*(columnValues[i] for i in blobColumns)):
+                blobValues.extend(values)
+
+        # Lay out the whole table. Offsets are relative to start, but blob alignment is absolute.
         start = stream.tell()
-        self.tree.rowsPointer = 8  # Dummy
-        self.tree.stringsPointer = 8  # Dummy
-        self.tree.blobsPointer = 8  # Dummy
-        self.tree.endPointer = 8  # Dummy
-        build_pointer_laden_area()
-
-        # Write out strings and blobs
-        self.tree.stringsPointer = stream.tell()
-        GreedyBytes.build_stream(stringsIo.getvalue(), stream)
-        firstLoop = True
-        blobsPointer = stream.tell()
-        for (runtimeBlob, treeBlob) in blobValues:
+        columnsSize = sum(
+            5 + (value_size(treeColumn.types.value) if treeColumn.types.column == "constant" else 0)
+            for treeColumn in self.tree.columns)
+        rowFormat = RowFormat(variableColumns)
+        rowsOffset = 32 + columnsSize
+        stringsOffset = rowsOffset + rowFormat.size * rowCount
+        blobsOffset = None
+        blobLayout = []  # (offset, length, data to write) or None; data is None for shared blobs
+        dedupe = self.dedupe_blobs if dedupe_blobs is None else dedupe_blobs
+        storedBlobs = {}  # (prepadded, length, digest) -> offset
+        blobBytesSaved = 0
+        end = stringsOffset + len(strings.data)
+        for runtimeBlob in blobValues:
             if not runtimeBlob:
-                treeBlob["blobLength"] = 0
-                treeBlob["blobPointer"] = 0
+                blobLayout.append(None)
                 continue
-            treeBlob["blobLength"] = runtimeBlob.length  # + runtimeBlob.postPadding
-            absolutePointer = runtimeBlob.build_stream(stream)
-            if firstLoop:
-                blobsPointer = absolutePointer
-                firstLoop = False
-            treeBlob["blobPointer"] = absolutePointer - blobsPointer
-
-        self.tree.blobsPointer = blobsPointer
+            data = runtimeBlob
+            if dedupe and runtimeBlob.length:
+                data = runtimeBlob.view()
+                key = (runtimeBlob.length, hashlib.sha1(data).digest())
+                # a prepadded copy can stand in for a blob that doesn't need alignment, but not the other way around
+                shared = storedBlobs.get((runtimeBlob.shouldPrepad,) + key)
+                if shared is not None:
+                    blobLayout.append((shared, runtimeBlob.length, None))
+                    blobBytesSaved += runtimeBlob.length
+                    continue
+            if runtimeBlob.shouldPrepad:
+                end += 32 - ((start + end) % 32)
+            if blobsOffset is None:
+                blobsOffset = end
+            if dedupe and runtimeBlob.length:
+                storedBlobs.setdefault((runtimeBlob.shouldPrepad,) + key, end)
+                storedBlobs.setdefault((False,) + key, end)
+            blobLayout.append((end, runtimeBlob.length, data))
+            end += runtimeBlob.length
+        if blobsOffset is None:
+            blobsOffset = end
+
         # Always pad file to multiple of 4 bytes, except the top level which is padded to 32 with a minimum of 1 byte
-        size = stream.tell() - start
         if self.name == "Header":
-            # Pad top-level acb to 32 byte boundary with a minimum of 1 byte
-            postPadding = 32 - (stream.tell() % 32)
-            Bytes(postPadding).build_stream(b"\x00" * postPadding, stream)
+            end += 32 - ((start + end) % 32)
+        elif end % 4:
+            end += 4 - (end % 4)
+
+        def blob_pointer(layout):
+            return (layout[0] - blobsOffset, layout[1]) if layout else (0, 0)
+
+        # Fill in blob pointers
+        blobPointers = [blob_pointer(layout) for layout in blobLayout]
+        for treeColumn, pointer in zip(constantBlobColumns, blobPointers):
+            treeColumn.constant = {'blobPointer': pointer[0], 'blobLength': pointer[1]}
+        rowBlobPointers = iter(blobPointers[len(constantBlobColumns):])
+        if rowCount and blobColumns:
+            for i in blobColumns:
+                columnValues[i] = []
+            for _ in range(rowCount):
+                for i in blobColumns:
+                    columnValues[i].append(next(rowBlobPointers))
+
+        # Write everything into one buffer
+        buffer = bytearray(end)
+        # a table without variable columns keeps the dummy rows pointer of 8
+        rowsPointer = rowsOffset - 8 if variableColumns else -start
+        struct.pack_into(">4sIHHIIIHHI", buffer, 0, b"@UTF", end - 8, self.tree.header.version, rowsPointer,
+                         stringsOffset - 8, blobsOffset - 8, self.tree.header.unk, len(self.tree.columns),
+                         self.tree.header.rowSize, rowCount)
+        offset = 32
+        for treeColumn in self.tree.columns:
+            types = treeColumn.types
+            buffer[offset] = (COLUMN_TYPE_NIBBLES[str(types.column)] << 4) | VALUE_TYPE_NIBBLES[str(types.value)]
+            struct.pack_into(">I", buffer, offset + 1, treeColumn.namePointer)
+            offset += 5
+            if types.column == "constant":
+                constant = treeColumn.constant
+                if types.value == "string":
+                    constant = constant["stringPointer"]
+                elif types.value == "blob":
+                    constant = (constant["blobPointer"], constant["blobLength"])
+                pack_value(buffer, offset, types.value, constant)
+                offset += value_size(types.value)
+
+        rowFormat.pack_rows(buffer, rowsOffset, columnValues)
+        buffer[stringsOffset:stringsOffset + len(strings.data)] = strings.data
+        for layout in blobLayout:
+            if layout and layout[2] is not None:
+                data = layout[2]
+                buffer[layout[0]:layout[0] + layout[1]] = data if isinstance(data, memoryview) else data.view()
+
+        stream.write(buffer)
+
+        self.lastBuildReport = UtfBuildReport(self.name, end, len(strings.data), strings.bytesSaved, blobBytesSaved)
+        if strings.compact or dedupe:
+            log.debug(f"Built table '{self.name}' ({end} bytes), {strings.bytesSaved} bytes saved by sharing strings, "
+                      f"{blobBytesSaved} bytes saved by sharing blobs")
+
+    def column(self, columnName: str):
+        """Returns every value of a column, in row order. Cheap for numeric columns of columnar tables."""
+        column = self.columns[columnName]
+        if column.types.column == "constant":
+            return [column.constant] * len(self.rows)
+        elif isinstance(self.rows, ColumnarRows):
+            return self.rows.column_values(columnName)
         else:
-            if size % 4:
-                postPadding = 4 - (size % 4)
-                Bytes(postPadding).build_stream(b"\x00" * postPadding, stream)
-        self.tree.endPointer = stream.tell()
-
-        # Write out second pass to insert blob pointers
-        stream.seek(start)
-        build_pointer_laden_area()
-        stream.seek(self.tree.endPointer)
+            return [row[columnName].value for row in self.rows]
 
     def get(self, row: int, columnName: str):
         column = self.columns[columnName]
@@ -325,6 +599,7 @@ class Utf:
                 f"set() used on non-constant field '{columnName}' but argument 'constant' is {constant}. Set 'constant' to False to set as variable.")
 
         if constant:
+            self.__rawSource = None
             column.constant = value
         else:
             self.rows[row][columnName].value = value
@@ -338,3 +613,13 @@ class Utf:
 
     def delete_row(self, row: int):
         self.rows.pop(row)
+
+    def select_rows(self, rows):
+        """Keeps only the given rows, in the given order.
+
+        :param: rows: Indices of the rows to keep
+        """
+        if isinstance(self.rows, ColumnarRows):
+            self.rows.select(rows)
+        else:
+            self.rows = [self.rows[i] for i in rows]
@@ -1,4 +1,6 @@
+import os
 import struct
+from contextlib import contextmanager
 
 
 def i16swap(i16: int):
@@ -15,3 +17,18 @@ def i32swap(i32: int):
 
 def u32swap(u32: int):
     return struct.unpack("<I", struct.pack(">I", u32))[0]
+
+
+@contextmanager
+def atomic_write(path, mode="wb"):
+    """Opens a temporary file next to path and moves it over path once the block is done, so path never holds a
+    partially written file. The temporary file is removed if the block fails."""
+    tempPath = f"{os.fspath(path)}.tmp"
+    try:
+        with open(tempPath, mode) as f:
+            yield f
+        os.replace(tempPath, path)
+    except BaseException:
+        if os.path.exists(tempPath):
+            os.unlink(tempPath)
+        raise
@@ -0,0 +1,87 @@
+"""Measures how long appending one song to a streaming AWB takes, for AWBs of different sizes.
+
+Compares rebuilding the AWB through construct (how Awb.build_file used to work), writing it entry by entry,
+splicing the existing entries in with one copy (what Awb.build_file does without a hasher) and writing it while
+hashing it, which is what the editor does (StreamAwbTable.build_awb_file), since the ACB needs the MD5 of the AWB.
+
+Run from the repository root: python -m benchmarks.bench_awb_append [AWB sizes in MB...]
+"""
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+from tabulate import tabulate
+
+from atom_types.file.awb_file import Awb_File
+from atom_types.runtime.awb import Awb
+from atom_types.runtime.awb_writer import AwbWriter
+from benchmarks.synthetic_awb import write_synthetic_awb
+
+ENTRY_SIZE = 1024 * 1024
+SONG_SIZE = 3 * 1024 * 1024
+
+
+def append_construct(awb_path, song_path, out_path):
+    with open(awb_path, "rb") as f, open(song_path, "rb") as song, open(out_path, "wb") as out:
+        tree = Awb_File.parse_stream(f)
+        tree.files.append(song.read())
+        Awb_File.build_stream(tree, out)
+
+
+def append_per_entry(awb_path, song_path, out_path):
+    awb = Awb.parse_file(awb_path)
+    awb.appendFile(song_path)
+    with open(out_path, "wb") as out:
+        AwbWriter(out, spliceRuns=False).write(awb.tree.header, awb.tree.files)
+
+
+def append_spliced(awb_path, song_path, out_path):
+    awb = Awb.parse_file(awb_path)
+    awb.appendFile(song_path)
+    awb.build_file(out_path)
+
+
+def append_hashed(awb_path, song_path, out_path):
+    awb = Awb.parse_file(awb_path)
+    awb.appendFile(song_path)
+    awb.build_file(out_path, hashlib.md5())
+
+
+def time_append(append, awb_path, song_path, out_path, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        append(awb_path, song_path, out_path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        os.unlink(out_path)
+    return best
+
+
+def main():
+    sizes_mb = [int(arg) for arg in sys.argv[1:]] or [16, 64, 256]
+    data = []
+    with tempfile.TemporaryDirectory() as directory:
+        song_path = os.path.join(directory, "song.hca")
+        out_path = os.path.join(directory, "out.awb")
+        with open(song_path, "wb") as f:
+            f.write(os.urandom(SONG_SIZE))
+
+        for size_mb in sizes_mb:
+            awb_path = os.path.join(directory, f"{size_mb}.awb")
+            entry_count = max(1, size_mb * 1024 * 1024 // ENTRY_SIZE)
+            write_synthetic_awb(awb_path, entry_count, ENTRY_SIZE)
+            repeat = 3 if size_mb <= 64 else 1
+            times = [time_append(append, awb_path, song_path, out_path, repeat)
+                     for append in (append_construct, append_per_entry, append_spliced, append_hashed)]
+            os.unlink(awb_path)
+            data.append([size_mb, entry_count] + [f"{t * 1000:.1f}" for t in times])
+
+    print(tabulate(data, headers=["AWB (MB)", "Entries", "construct (ms)", "per entry (ms)", "spliced (ms)",
+                                 "spliced + MD5 (ms)"]))
+
+
+if __name__ == "__main__":
+    main()
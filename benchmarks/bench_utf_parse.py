@@ -0,0 +1,39 @@
+"""Compares Utf.parse row decoding with construct against the compiled struct decoder.
+
+Run from the repository root: python -m benchmarks.bench_utf_parse [row counts...]
+"""
+import sys
+import time
+
+from tabulate import tabulate
+
+from atom_types.runtime.utf import Utf
+from benchmarks.synthetic_utf import build_synthetic_table
+
+
+def time_parse(data: bytes, row_decoder: str, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        Utf.parse(data, row_decoder=row_decoder)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    row_counts = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 5000]
+    data = []
+    for row_count in row_counts:
+        table = build_synthetic_table(row_count)
+        repeat = 3 if row_count <= 1000 else 1
+        construct_time = time_parse(table, "construct", repeat)
+        struct_time = time_parse(table, "struct", repeat)
+        data.append([row_count, len(table), f"{construct_time * 1000:.1f}", f"{struct_time * 1000:.1f}",
+                     f"{construct_time / struct_time:.1f}x"])
+
+    print(tabulate(data, headers=["Rows", "Bytes", "construct (ms)", "struct (ms)", "Speedup"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import os
+import struct
+
+
+def write_synthetic_awb(path, entry_count: int, entry_size: int, alignment: int = 32):
+    """Writes an AFS2 archive with `entry_count` entries of `entry_size` random bytes each.
+
+    Written with plain struct calls so it doesn't depend on the code being measured. Every entry has the same
+    contents, so large archives can be written without generating that much random data.
+    """
+    entry = os.urandom(entry_size)
+    header_size = 16 + 2 * entry_count + 4 * (entry_count + 1)
+    pointers = [header_size]
+    for _ in range(entry_count):
+        start = pointers[-1] + (-pointers[-1] % alignment)
+        pointers.append(start + entry_size)
+
+    with open(path, "wb") as f:
+        f.write(struct.pack("<4sBBHII", b"AFS2", 2, 4, 2, entry_count, alignment))
+        f.write(struct.pack(f"<{entry_count}H", *range(entry_count)))
+        f.write(struct.pack(f"<{entry_count + 1}I", *pointers))
+        for pointer in pointers[:-1]:
+            f.write(b"\x00" * (-pointer % alignment))
+            f.write(entry)
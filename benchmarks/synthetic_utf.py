@@ -0,0 +1,70 @@
+import struct
+
+# (name, storage, value type nibble, struct format)
+# signed integers and floats are little-endian and unsigned integers, string and blob pointers are
+# big-endian, matching how UtfField reads them
+SYNTHETIC_COLUMNS = [
+    ("Version", "constant", 0x04, "<i"),
+    ("CueId", "variable", 0x04, "<i"),
+    ("ReferenceIndex", "variable", 0x02, "<h"),
+    ("Priority", "variable", 0x01, ">B"),
+    ("Flags", "variable", 0x03, ">H"),
+    ("Length", "variable", 0x05, ">I"),
+    ("Volume", "variable", 0x08, "<f"),
+    ("CueName", "variable", 0x0a, ">I"),
+    ("Command", "variable", 0x0b, ">II"),
+    ("ControlWorkArea1", "variable", 0x02, "<h"),
+]
+
+STORAGE_NIBBLES = {"constant": 0x3, "variable": 0x5}
+
+
+def build_synthetic_table(row_count: int, name: str = "SyntheticTable") -> bytes:
+    """Builds a raw @UTF table with a mix of column types and `row_count` rows.
+
+    Written with plain struct calls so it doesn't depend on the code being measured.
+    """
+    strings = bytearray()
+    stringPointers = {}
+
+    def add_string(value: str):
+        if value not in stringPointers:
+            stringPointers[value] = len(strings)
+            strings.extend(value.encode("utf8") + b"\x00")
+        return stringPointers[value]
+
+    add_string(name)
+
+    columns = bytearray()
+    for columnName, storage, valueType, fmt in SYNTHETIC_COLUMNS:
+        columns.append((STORAGE_NIBBLES[storage] << 4) | valueType)
+        columns.extend(struct.pack(">I", add_string(columnName)))
+        if storage == "constant":
+            columns.extend(struct.pack(fmt, 1))
+
+    blobs = bytearray()
+    rows = bytearray()
+    for i in range(row_count):
+        command = struct.pack(">hBhhBh", 2000, 4, 2, i & 0x7fff, 0, 0)
+        blobPointer = len(blobs)
+        blobs.extend(command)
+        rows.extend(struct.pack("<i", i))
+        rows.extend(struct.pack("<h", i & 0x7fff))
+        rows.extend(struct.pack(">B", i & 0xff))
+        rows.extend(struct.pack(">H", (i * 7) & 0xffff))
+        rows.extend(struct.pack(">I", i * 1000))
+        rows.extend(struct.pack("<f", 1.0))
+        rows.extend(struct.pack(">I", add_string(f"MER_BGM_S04_{i:03}")))
+        rows.extend(struct.pack(">II", blobPointer, len(command)))
+        rows.extend(struct.pack("<h", i & 0x7fff))
+
+    rowSize = len(rows) // row_count if row_count else 0
+    rowsPointer = 32 + len(columns)
+    stringsPointer = rowsPointer + len(rows)
+    blobsPointer = stringsPointer + len(strings)
+    end = blobsPointer + len(blobs)
+    padding = (4 - end % 4) % 4
+
+    header = struct.pack(">4sIHHIIIHHI", b"@UTF", end + padding - 8, 1, rowsPointer - 8, stringsPointer - 8,
+                         blobsPointer - 8, 0, len(SYNTHETIC_COLUMNS), rowSize, row_count)
+    return header + bytes(columns) + bytes(rows) + bytes(strings) + bytes(blobs) + b"\x00" * padding
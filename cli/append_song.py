@@ -1,6 +1,7 @@
 import logging
 import sys
 
+from atom_types.runtime.utf import Utf
 from audio import preprocessor
 from tui.handlers.write_acb import WriteAcb
 from tui.program import TuiProgram
@@ -8,6 +9,16 @@ from tui.state_type import StateType
 from tui.ui import UiHandler
 
 
+def apply_build_options(args):
+    Utf.compact_strings = args.compact
+    Utf.dedupe_blobs = args.compact
+
+
+def apply_cue_name_options(args, state):
+    state.cue_name_prefix = args.cue_prefix
+    state.cue_name_padding = args.cue_padding
+
+
 def cli_append_song_list(args):
     log = logging.getLogger("cli_append_song_list")
     acb_path = args.acb_path
@@ -16,6 +27,8 @@ def cli_append_song_list(args):
     program = TuiProgram(args.debug is True)
     ui = program.ui
     state = ui.state
+    apply_build_options(args)
+    apply_cue_name_options(args, state)
 
     # preprocess the songs
     pp = preprocessor.AudioPreprocessor()
@@ -63,6 +76,8 @@ def cli_append_song(args):
     program = TuiProgram(args.debug is True)
     ui = program.ui
     state = ui.state
+    apply_build_options(args)
+    apply_cue_name_options(args, state)
 
     # preprocess the song
     log.info("Preprocessing song")
@@ -37,3 +37,4 @@ class ChooseAcb(UiHandler):
         self.ui.state.awb_path = os.path.abspath(awb_dir)
         self.ui.state.acb_path = os.path.abspath(acb_path)
         self.ui.state.acb_in = None  # we'll load it later
+        self.ui.state.cue_name_allocator = None
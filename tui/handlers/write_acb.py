@@ -1,6 +1,8 @@
 from tabulate import tabulate
 
-from atom_types.runtime.acb import Acb
+from atom_types.runtime.acb import Acb, NewSong
+from atom_types.runtime.cue_name_allocator import CueNameAllocator
+from atom_types.runtime.util import atomic_write
 from atom_types.runtime.table.stream_awb import StreamAwbTable
 from tui.handlers.quit import cleanup_queue
 from tui.state import State
@@ -95,20 +97,12 @@ class WriteAcb(UiHandler):
             raise FileExistsError("ACB is already loaded")
         self.log.debug(f"Opening ACB file '{self.ui.state.acb_path}'")
         self.ui.state.acb_in = Acb.parse_stream(self.ui.state.awb_path, open(self.ui.state.acb_path, "rb"))
+        # built once, and kept up to date with the names it hands out
+        self.ui.state.cue_name_allocator = CueNameAllocator(
+            self.ui.state.acb_in.tables.cueNames.utf.column("CueName"), self.ui.state.cue_name_padding)
 
     def next_cue_name(self):
-        def gen_name(i: int):
-            return f"{prefix}_{str(i).zfill(3)}"
-
-        # TODO: configurable prefix
-        prefix = "MER_BGM_S04"
-
-        acb = self.ui.state.acb_in
-        current_names = set(x['CueName'].value for x in acb.tables.cueNames.utf.rows)
-        index = 0
-        while gen_name(index) in current_names:
-            index += 1
-        return gen_name(index)
+        return self.ui.state.cue_name_allocator.next(self.ui.state.cue_name_prefix)
 
     def write(self, target_awb_name: str, output_acb_name: str = "MER_BGM.acb.injected") -> dict[str, str]:
         """Does the write.
@@ -121,42 +115,39 @@ class WriteAcb(UiHandler):
 
         # get the index out of the name map
         index = stream_awbs.awbListIndexByName[target_awb_name]
-        acb.tables.streamAwbs.mark_awb_for_rehash(index)
 
         # append all the songs to the awb
         awb_info = stream_awbs.awbList[index]
         for song in self.ui.state.file_queue:
             self.log.debug(f"Appending '{song.path}' to {target_awb_name}")
-            file_id = awb_info.awb.appendFile(open(song.path, "rb"))
+            # only read when the awb is built
+            file_id = awb_info.awb.appendFile(song.path)
             song.new_index = file_id
             self.log.debug(f"New ID for '{song.path}' is {file_id}")
 
         # append all the songs to the acb
-        for song in self.ui.state.file_queue:
-            cue_name = self.next_cue_name()
+        cue_names = self.ui.state.cue_name_allocator.reserve(self.ui.state.cue_name_prefix,
+                                                             len(self.ui.state.file_queue))
+        new_songs = []
+        for song, cue_name in zip(self.ui.state.file_queue, cue_names):
             self.log.debug(f"Got cue name '{cue_name}' for file '{song.path}'")
             appended_files[song.orig_filename] = cue_name
-
-            acb.add_song_to_awb(
+            new_songs.append(NewSong(
                 cue_name=cue_name,
                 awb_id=index,
                 awb_file_id=song.new_index,
                 num_samples=song.sample_count,
                 length_ms=song.length_ms
-            )
+            ))
+        acb.add_songs(new_songs)
 
-        # write out new awb
+        # write out new awb, which also updates its hash and header in the acb. the awb reads its entries from
+        # the written file afterwards, so the queued songs can be cleaned up and written again to the same file
         out_awb_name = f"{target_awb_name}.injected"
-        awb_info.awb.build_file(out_awb_name)
-
-        # update streaming AWB headers
-        remap = {
-            f"{target_awb_name}.awb": out_awb_name # we want to read .injected, not the original
-        }
-        acb.update_streaming_awb_headers(remap=remap)
+        acb.commit_streaming_awb(index, out_awb_name)
 
         # write out new acb
-        with open(output_acb_name, "wb") as out:
+        with atomic_write(output_acb_name) as out:
             acb.build_stream(out)
 
         return appended_files
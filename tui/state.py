@@ -1,6 +1,7 @@
 from typing import List
 
 from atom_types.runtime.acb import Acb
+from atom_types.runtime.cue_name_allocator import CueNameAllocator
 from audio.preprocess_result import PreprocessResult
 from audio.preprocessor import AudioPreprocessor
 from tui.state_type import StateType
@@ -14,4 +15,9 @@ class State:
     acb_path: str = None
     acb_in: Acb = None
 
+    # new cues are named <prefix>_<number>, with the number zero-padded to cue_name_padding digits
+    cue_name_prefix: str = "MER_BGM_S04"
+    cue_name_padding: int = 3
+    cue_name_allocator: CueNameAllocator = None
+
     audio_preprocessor: AudioPreprocessor
@@ -186,6 +186,9 @@ def main():
     append.add_argument("--awb-dir", type=str, default=".", help="Optional path to the directory with AWB files")
     append.add_argument("--awb", type=str, help="Streaming AWB name or index")
     append.add_argument("--list-path", type=str, required=True, help="Path to the song list")
+    append.add_argument("--compact", action="store_true", help="Share identical strings and blobs when building tables")
+    append.add_argument("--cue-prefix", type=str, default="MER_BGM_S04", help="Prefix of new cue names")
+    append.add_argument("--cue-padding", type=int, default=3, help="Number of digits in new cue names")
     append.add_argument("--debug", type=bool, default=False, help="Show debug messages")
     append.set_defaults(func=cli.append_song.cli_append_song_list)
 
@@ -194,6 +197,9 @@ def main():
     append.add_argument("--awb-dir", type=str, default=".", help="Optional path to the directory with AWB files")
     append.add_argument("--awb", type=str, help="Streaming AWB name or index")
     append.add_argument("--song-path", type=str, required=True, help="Path to the song to add")
+    append.add_argument("--compact", action="store_true", help="Share identical strings and blobs when building tables")
+    append.add_argument("--cue-prefix", type=str, default="MER_BGM_S04", help="Prefix of new cue names")
+    append.add_argument("--cue-padding", type=int, default=3, help="Number of digits in new cue names")
     append.add_argument("--debug", type=bool, default=False, help="Show debug messages")
     append.set_defaults(func=cli.append_song.cli_append_song)
 